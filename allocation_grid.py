@@ -0,0 +1,77 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+
+# Equity step of the allocation grid in percent, e.g. VALGRO_ALLOCATION_STEP=5 for 100E, 95E, ..., 5E, 100F
+ALLOCATION_STEP_ENV = 'VALGRO_ALLOCATION_STEP'
+DEFAULT_ALLOCATION_STEP = 10
+
+
+class AllocationGrid:
+    """The allocations every stage works with, from 100% equity down to 100% fixed income.
+
+    Each allocation is an integer index into the grid (0 is 'LBM 100E', the last one is 'LBM 100F');
+    the 'LBM ..' names are only used for sheet columns and labels.
+    """
+
+    def __init__(self, step=DEFAULT_ALLOCATION_STEP):
+        step = int(step)
+        if step <= 0 or 100 % step:
+            raise ValueError(f"The allocation step must divide 100, got {step}.")
+        self.step = step
+        self.equity = np.arange(100, -1, -step)
+        self.fractions = self.equity / 100.0
+        self.names = [self.name_for_equity(equity) for equity in self.equity]
+        self._indices = {name: index for index, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._indices
+
+    @staticmethod
+    def name_for_equity(equity):
+        return 'LBM 100F' if equity == 0 else f'LBM {int(equity)}E'
+
+    @property
+    def blended_equity(self):
+        """Equity percentages of the mixes built from the 100E and 100F factors."""
+        return [int(equity) for equity in self.equity[1:-1]]
+
+    def index(self, name):
+        """Index of an allocation name, -1 if it is not on the grid."""
+        return self._indices.get(name, -1)
+
+    def indices(self, names):
+        return np.array([self.index(name) for name in names], dtype=np.int64)
+
+    def index_for_fraction(self, fraction):
+        """Index of the grid allocation nearest to an equity fraction, -1 if it is off the grid."""
+        try:
+            steps = round(float(fraction) * 100 / self.step)
+        except (TypeError, ValueError):
+            return -1
+        if not 0 <= steps <= 100 // self.step:
+            return -1
+        return len(self.names) - 1 - steps
+
+    def fraction(self, name):
+        """Equity fraction of an allocation name, NaN if it is not on the grid."""
+        index = self.index(name)
+        return self.fractions[index] if index >= 0 else np.nan
+
+
+def allocation_step():
+    return int(os.environ.get(ALLOCATION_STEP_ENV, DEFAULT_ALLOCATION_STEP))
+
+
+@lru_cache(maxsize=None)
+def _grid_for_step(step):
+    return AllocationGrid(step)
+
+
+def default_grid():
+    """The grid set by VALGRO_ALLOCATION_STEP (10% steps by default)."""
+    return _grid_for_step(allocation_step())
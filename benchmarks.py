@@ -0,0 +1,148 @@
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import s1
+import s2
+import s3
+import s4
+import s6
+import storage
+from cagr import calculate_all_cagr_differences
+from dynamic_engine import prepare_inputs
+from get_dynamic_ev import accumulate_results_for_rows, get_start_rows
+
+# Lengths of the synthetic factor series: the real 1152 months and a history ten times longer
+NUM_ROWS = (1152, 11520)
+REPEAT = 3
+DYNAMIC_MAX_YEARS = 5  # Horizon of the dynamic simulation benchmark, as in s9's default run
+CAGR_PERIODS = (1, 3, 5, 10, 15, 20)
+RESULTS_FILE = 'benchmark_results.csv'
+
+
+def synthetic_factors(num_rows=1152, seed=0, equity=(0.08, 0.16), fixed_income=(0.04, 0.05)):
+    """Annual factors of 100% equity and 100% fixed income, laid out like annual_factors_100E_100F_20_bps.xlsx.
+
+    Row i is the product of 12 monthly returns starting at month i, so consecutive rows overlap like the real
+    rolling annual factors. `equity` and `fixed_income` are the (mean, volatility) of the annual log return.
+    """
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for name, (mean, volatility) in (('LBM 100E', equity), ('LBM 100F', fixed_income)):
+        monthly = rng.normal(mean / 12, volatility / np.sqrt(12), num_rows + 11)
+        cumulative = np.concatenate([[0.0], np.cumsum(monthly)])
+        columns[name] = np.exp(cumulative[12:] - cumulative[:-12])
+
+    # Second resolution, a history ten times longer than the real one does not fit in nanosecond timestamps
+    start = pd.date_range('1926-01-01', periods=num_rows, freq='MS', unit='s')
+    end = pd.date_range('1926-12-31', periods=num_rows, freq='ME', unit='s')
+    df = pd.DataFrame({'Start': start, 'End': end})
+    for name, values in columns.items():
+        df[name] = values
+    return df
+
+
+def synthetic_growth(num_rows=1152, seed=0, columns=('Value', 'Growth')):
+    """Monthly cumulative growth of two series with a 'Date' column, laid out like val_gro.xlsx."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'Date': pd.date_range('1926-01-31', periods=num_rows, freq='ME', unit='s')})
+    for column in columns:
+        df[column] = np.exp(np.cumsum(rng.normal(0.09 / 12, 0.18 / np.sqrt(12), num_rows)))
+    return df
+
+
+def run_dynamic_simulation(max_years=DYNAMIC_MAX_YEARS):
+    """The simulation of get_dynamic_ev for one horizon over every start row, without writing the results."""
+    portfolio_df = storage.read_sheet('all_portfolio_annual_factor_20_bps.xlsx', sheet_name='allocation_factors')
+    matrix_df = storage.read_sheet('dynamic_data.xlsx', sheet_name='matrix')
+    allocation_df = storage.read_sheet('min_values_across_years_and_matrix.xlsx', sheet_name='cost_factors_with_rules')
+    inputs = prepare_inputs(portfolio_df, matrix_df, allocation_df)
+    start_rows = get_start_rows(max_years, num_rows=len(portfolio_df))
+    return accumulate_results_for_rows(portfolio_df, matrix_df, allocation_df, max_years, start_rows, inputs)
+
+
+def write_synthetic_inputs(num_rows, seed=0):
+    # The stages read their inputs from the binary cache, so no Excel file is needed
+    storage.write_sheets('annual_factors_100E_100F_20_bps.xlsx', {'Sheet1': synthetic_factors(num_rows, seed)},
+                         export_excel=False)
+
+
+def write_dynamic_matrix():
+    # get_dynamic_ev reads the matrix from dynamic_data.xlsx, a copy of the one s3 writes
+    matrix_df = storage.read_sheet('min_values_across_years_and_matrix.xlsx', sheet_name='Matrix')
+    storage.write_sheets('dynamic_data.xlsx', {'matrix': matrix_df}, export_excel=False)
+
+
+def benchmark_stages(num_rows, seed=0):
+    """(name, function) of every stage in the order they run; each reads what the one before it wrote."""
+    growth = synthetic_growth(num_rows, seed)
+    return [
+        ('s1', s1.run_factors_all_allocations),
+        ('s2', s2.run_mult_period_factors),
+        ('s3', s3.run_mins_and_matrix),
+        ('s4', s4.run_cost_matrix),
+        ('s6', s6.run_each_row_end_value),
+        ('dynamic', lambda: (write_dynamic_matrix(), run_dynamic_simulation())),
+        ('cagr', lambda: calculate_all_cagr_differences(growth, CAGR_PERIODS, 'Growth', 'Value')),
+    ]
+
+
+def time_call(func, repeat=REPEAT):
+    """Wall times of `repeat` calls and the peak traced memory of one more, traced, call."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    # Traced separately, tracemalloc slows the calls down
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return times, peak
+
+
+def run_benchmarks(num_rows=NUM_ROWS, repeat=REPEAT, seed=0, results_file=RESULTS_FILE):
+    """Times every stage on synthetic factors of each length and appends the results to `results_file`."""
+    results_file = os.path.abspath(results_file)
+    run_time = pd.Timestamp.now().isoformat(timespec='seconds')
+    results = []
+    working_directory = os.getcwd()
+
+    for rows in num_rows:
+        # Stages read and write workbooks in the working directory, so each length gets a scratch folder
+        with tempfile.TemporaryDirectory() as scratch:
+            os.chdir(scratch)
+            try:
+                write_synthetic_inputs(rows, seed)
+                for stage, func in benchmark_stages(rows, seed):
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        times, peak = time_call(func, repeat)
+                    results.append({
+                        'Run': run_time, 'Rows': rows, 'Stage': stage,
+                        'Best (s)': min(times), 'Median (s)': statistics.median(times),
+                        'Peak Memory (MB)': peak / 2 ** 20,
+                    })
+                    print(f"{rows:>6} rows  {stage:<8} best {min(times):8.3f} s  "
+                          f"median {statistics.median(times):8.3f} s  peak {peak / 2 ** 20:8.1f} MB")
+            finally:
+                os.chdir(working_directory)
+
+    results_df = pd.DataFrame(results)
+    results_df.to_csv(results_file, mode='a', index=False, header=not os.path.exists(results_file))
+    print(f"Benchmark results appended to: {results_file}")
+    return results_df
+
+
+if __name__ == "__main__":
+    run_benchmarks()
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+
+def calculate_cagr_differences(data, period_years, column_1, column_2, date_column='Date'):
+    """CAGR of `column_1` minus CAGR of `column_2` over every rolling window of `period_years` years.
+
+    The columns hold cumulative growth, so each window's CAGR is the ratio of the value at the end of the
+    window to the value at its start, and all windows come from two shifted views of the same array.
+    """
+    period_length_months = period_years * 12
+    num_windows = len(data) - period_length_months + 1
+    if num_windows <= 0:
+        return pd.DataFrame(columns=['Start Date', 'End Date', 'CAGR Difference'])
+
+    cumulative_1 = data[column_1].to_numpy(dtype=float)
+    cumulative_2 = data[column_2].to_numpy(dtype=float)
+    dates = data[date_column].to_numpy()
+
+    # Window i starts at row i and ends at row i + period_length_months - 1
+    starts = slice(0, num_windows)
+    ends = slice(period_length_months - 1, period_length_months - 1 + num_windows)
+
+    cagr_1 = ((cumulative_1[ends] / cumulative_1[starts]) ** (1 / period_years)) - 1
+    cagr_2 = ((cumulative_2[ends] / cumulative_2[starts]) ** (1 / period_years)) - 1
+
+    return pd.DataFrame({
+        'Start Date': dates[starts],
+        'End Date': dates[ends],
+        'CAGR Difference': cagr_1 - cagr_2
+    })
+
+
+def calculate_all_cagr_differences(data, periods, column_1, column_2, date_column='Date'):
+    """Returns {period: CAGR difference DataFrame} for every period in `periods`."""
+    return {
+        period: calculate_cagr_differences(data, period, column_1, column_2, date_column)
+        for period in periods
+    }
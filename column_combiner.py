@@ -0,0 +1,68 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import pandas as pd
+from openpyxl import load_workbook
+
+import storage
+
+# Extracted columns are kept under the workbook's cache folder and reused until the workbook changes
+COLUMN_CACHE_NAME = 'last_columns'
+
+
+def column_cache_path(workbook_path, sheet_name):
+    return os.path.join(storage.workbook_cache_dir(workbook_path), COLUMN_CACHE_NAME, f'{sheet_name}.parquet')
+
+
+def read_last_column(workbook_path, sheet_name=0):
+    """Parses only the last column of one sheet, streaming the workbook in read-only mode."""
+    workbook = load_workbook(workbook_path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet_name] if isinstance(sheet_name, str) else workbook.worksheets[sheet_name]
+        last_column = worksheet.max_column
+        values = [row[0] for row in worksheet.iter_rows(min_col=last_column, max_col=last_column, values_only=True)]
+    finally:
+        workbook.close()
+
+    # The first row is the header, as with pd.read_excel
+    return pd.Series(values[1:], name=values[0])
+
+
+def _read_cached_column(workbook_path, sheet_name):
+    cache_path = column_cache_path(workbook_path, sheet_name)
+    if not os.path.exists(cache_path) or os.path.getmtime(workbook_path) > os.path.getmtime(cache_path):
+        return None
+    return pd.read_parquet(cache_path).iloc[:, 0]
+
+
+def _write_cached_column(workbook_path, sheet_name, column):
+    cache_path = column_cache_path(workbook_path, sheet_name)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    column.to_frame().to_parquet(cache_path)
+
+
+def load_last_columns(workbook_paths, sheet_name=0, workers=None):
+    """Returns the last column of `sheet_name` from every workbook, in order.
+
+    Columns cached since the workbook was last written are reused, the other workbooks are parsed in a
+    process pool (workers=None uses every core, workers=1 parses them here).
+    """
+    workbook_paths = list(workbook_paths)
+    columns = [_read_cached_column(path, sheet_name) for path in workbook_paths]
+    stale = [position for position, column in enumerate(columns) if column is None]
+
+    stale_paths = [workbook_paths[position] for position in stale]
+    workers = min(workers or os.cpu_count() or 1, len(stale_paths))
+    if workers <= 1:
+        parsed = [read_last_column(path, sheet_name) for path in stale_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            parsed = list(executor.map(read_last_column, stale_paths, repeat(sheet_name)))
+
+    for position, column in zip(stale, parsed):
+        _write_cached_column(workbook_paths[position], sheet_name, column)
+        columns[position] = column
+
+    return columns
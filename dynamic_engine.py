@@ -0,0 +1,214 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import dynamic_jit
+from allocation_grid import default_grid
+
+# Allocation codes index into inputs['names'] (-1 is 'NA'); even a 1% grid has only 101 allocations
+CODE_DTYPE = np.int8
+
+# Kernel of simulate_paths: 'numpy', or 'numba' for the compiled loop in dynamic_jit (NumPy if Numba is missing)
+BACKEND_ENV = 'VALGRO_DYNAMIC_BACKEND'
+DEFAULT_BACKEND = 'numpy'
+BACKENDS = ('numpy', 'numba')
+
+_warned_missing_numba = False
+
+
+def dynamic_backend(backend=None):
+    """The backend to run: `backend` if given, else VALGRO_DYNAMIC_BACKEND, falling back to NumPy without Numba."""
+    global _warned_missing_numba
+    backend = backend or os.environ.get(BACKEND_ENV, DEFAULT_BACKEND)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown dynamic backend '{backend}', expected one of {BACKENDS}.")
+    if backend == 'numba' and not dynamic_jit.NUMBA_AVAILABLE:
+        if not _warned_missing_numba:
+            print("Numba is not installed, the dynamic simulation runs on NumPy.")
+            _warned_missing_numba = True
+        return 'numpy'
+    return backend
+
+
+def allocation_for_percentage(allocation_percentage, grid=None):
+    grid = grid or default_grid()
+    index = grid.index_for_fraction(allocation_percentage)
+    return grid.names[index] if index >= 0 else 'Unknown Allocation'
+
+
+def prepare_inputs(portfolio_df, matrix_df, allocation_df, grid=None):
+    """Maps the allocations onto grid indices once and holds the factors, matrix and start allocations as dense arrays."""
+    grid = grid or default_grid()
+
+    # Allocations are sorted by equity so the first eligible one is always the lowest
+    grid_codes = sorted({grid.index(name) for name in matrix_df['Allocation']} - {-1}, key=lambda code: grid.equity[code])
+    names = [grid.names[code] for code in grid_codes]
+    matrix_rows = matrix_df.drop_duplicates('Allocation').set_index('Allocation').loc[names]
+
+    # Start allocation and start value for every time period, as found in the cost factors
+    year_columns = [col for col in allocation_df.columns if col.startswith('Year_')]
+    start_grid_codes = {}
+    start_values = {}
+    for col in year_columns:
+        time_period = int(col.split('_')[1])
+        percentage = allocation_df.loc[allocation_df['Factor'] == 'Lowest Cost Allocation', col].values[0]
+        start_grid_codes[time_period] = grid.index_for_fraction(percentage)
+        start_values[time_period] = allocation_df.loc[1, col]
+
+    # A start allocation missing from the matrix can still be held, it just can never be moved into
+    extra_codes = sorted({code for code in start_grid_codes.values() if code >= 0 and code not in grid_codes},
+                         key=lambda code: grid.equity[code])
+    all_codes = grid_codes + extra_codes
+    all_names = [grid.names[code] for code in all_codes]
+
+    matrix_columns = sorted((col for col in matrix_rows.columns if col.startswith('Year_')),
+                            key=lambda col: int(col.split('_')[1]))
+    thresholds = np.full((len(all_names), len(matrix_columns)), np.nan)
+    thresholds[:len(names)] = matrix_rows[matrix_columns].to_numpy(dtype=float)
+
+    return {
+        'names': all_names,
+        'equity': grid.equity[all_codes] if all_codes else np.array([], dtype=int),
+        'thresholds': thresholds,
+        'matrix_years': {int(col.split('_')[1]): i for i, col in enumerate(matrix_columns)},
+        'factors': portfolio_df[all_names].to_numpy(dtype=float),
+        'start_codes': {year: (all_codes.index(code) if code in all_codes else -1)
+                        for year, code in start_grid_codes.items()},
+        'start_values': start_values,
+    }
+
+
+def simulate_path(inputs, time_period, start_index):
+    """Runs the glide path for one start row, returning allocation codes, factors used and ending values.
+
+    Year 1 has no allocation and is coded -1.
+    """
+    code = inputs['start_codes'][time_period]
+    if code < 0:
+        raise ValueError("The initial allocation could not be determined.")
+
+    equity = inputs['equity']
+    thresholds = inputs['thresholds']
+    matrix_years = inputs['matrix_years']
+    factors = inputs['factors']
+
+    codes = np.empty(time_period, dtype=CODE_DTYPE)
+    factors_used = np.empty(time_period)
+    values = np.empty(time_period)
+
+    value = inputs['start_values'][time_period]
+    codes[0] = -1
+    factors_used[0] = value
+    values[0] = value
+
+    for year in range(2, time_period + 1):
+        if year > 2:
+            # Move to the lowest allocation below the current one whose matrix value the portfolio now covers
+            matrix_column = matrix_years[time_period - (year - 1) + 1]
+            eligible = (thresholds[:, matrix_column] <= value) & (equity < equity[code])
+            if eligible.any():
+                code = int(eligible.argmax())
+
+        factor = factors[(year - 2) * 12 + start_index, code]
+        value = value * factor
+        codes[year - 1] = code
+        factors_used[year - 1] = factor
+        values[year - 1] = value
+
+    return codes, factors_used, values
+
+
+def allocation_labels(inputs, codes):
+    names = np.array(inputs['names'] + ['NA'], dtype=object)
+    return names[codes]
+
+
+def allocation_categorical(inputs, codes):
+    """The allocation names of `codes` as a pandas Categorical, which only stores one small code per entry."""
+    categories = inputs['names'] + ['NA']
+    codes = np.asarray(codes)
+    return pd.Categorical.from_codes(np.where(codes < 0, len(categories) - 1, codes), categories=categories)
+
+
+def simulate_paths(inputs, time_period, start_rows, backend=None, step=12):
+    """Runs the glide path for many start rows in lockstep, returning (rows, years) arrays.
+
+    Every path advances one year at a time: a vector of current allocation codes, a vector of values and a
+    gather from the factor array replace the per-row loop of simulate_path. With the 'numba' backend (passed
+    here, set as inputs['backend'] or through VALGRO_DYNAMIC_BACKEND) the per-path loop runs compiled
+    instead, across threads, with the same results.
+
+    Year y of the path from start row s uses factor row (y - 2) * step + s; the monthly factors take a 12 row
+    step to the next year.
+    """
+    code = inputs['start_codes'][time_period]
+    if code < 0:
+        raise ValueError("The initial allocation could not be determined.")
+
+    equity = inputs['equity']
+    thresholds = inputs['thresholds']
+    matrix_years = inputs['matrix_years']
+    factors = inputs['factors']
+
+    start_rows = np.asarray(start_rows, dtype=np.int64)
+    num_paths = len(start_rows)
+    codes = np.empty((num_paths, time_period), dtype=CODE_DTYPE)
+    factors_used = np.empty((num_paths, time_period))
+    values = np.empty((num_paths, time_period))
+
+    if dynamic_backend(backend or inputs.get('backend')) == 'numba':
+        # The compiled loop does not check bounds, so a path running past the factors fails here as with NumPy
+        if num_paths and time_period > 1 and (time_period - 2) * step + start_rows.max() >= len(factors):
+            raise IndexError(f"Start row {start_rows.max()} runs past the {len(factors)} factor rows "
+                             f"in a {time_period} year time period.")
+        dynamic_jit.simulate_paths_kernel(
+            factors, thresholds, equity, dynamic_jit.matrix_columns_for_period(matrix_years, time_period), code,
+            float(inputs['start_values'][time_period]), start_rows, step, codes, factors_used, values)
+        return codes, factors_used, values
+
+    current_codes = np.full(num_paths, code, dtype=np.int64)
+    current_values = np.full(num_paths, inputs['start_values'][time_period], dtype=float)
+    codes[:, 0] = -1
+    factors_used[:, 0] = current_values
+    values[:, 0] = current_values
+
+    for year in range(2, time_period + 1):
+        if year > 2:
+            matrix_column = matrix_years[time_period - (year - 1) + 1]
+            eligible = ((thresholds[:, matrix_column][np.newaxis, :] <= current_values[:, np.newaxis]) &
+                        (equity[np.newaxis, :] < equity[current_codes][:, np.newaxis]))
+            current_codes = np.where(eligible.any(axis=1), eligible.argmax(axis=1), current_codes)
+
+        factor = factors[(year - 2) * step + start_rows, current_codes]
+        current_values = current_values * factor
+        codes[:, year - 1] = current_codes
+        factors_used[:, year - 1] = factor
+        values[:, year - 1] = current_values
+
+    return codes, factors_used, values
+
+
+def simulate_horizons(inputs, max_years, start_rows, rows_per_period=None, backend=None):
+    """Simulates every time period from 2 to max_years for each start row.
+
+    Returns (rows, max_years - 1, max_years) arrays; years past a path's time period hold value 0 and code -1.
+    With rows_per_period ({time_period: n}) a time period is only simulated for its first n start rows and the
+    other rows stay padded, so paths no caller needs are never computed.
+    """
+    num_paths = len(start_rows)
+    shape = (num_paths, max(max_years - 1, 0), max_years)
+    codes = np.full(shape, -1, dtype=CODE_DTYPE)
+    factors_used = np.zeros(shape)
+    values = np.zeros(shape)
+
+    for time_period in range(2, max_years + 1):
+        num_rows = num_paths if rows_per_period is None else rows_per_period.get(time_period, 0)
+        if num_rows == 0:
+            continue
+        path_codes, path_factors, path_values = simulate_paths(inputs, time_period, start_rows[:num_rows], backend)
+        codes[:num_rows, time_period - 2, :time_period] = path_codes
+        factors_used[:num_rows, time_period - 2, :time_period] = path_factors
+        values[:num_rows, time_period - 2, :time_period] = path_values
+
+    return codes, factors_used, values
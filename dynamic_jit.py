@@ -0,0 +1,51 @@
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # Numba is optional, dynamic_engine falls back to NumPy without it
+    numba = None
+
+NUMBA_AVAILABLE = numba is not None
+
+
+def matrix_columns_for_period(matrix_years, time_period):
+    """Matrix column checked in each year of a time period, indexed by year (-1 for years 1 and 2)."""
+    columns = np.full(time_period + 1, -1, dtype=np.int64)
+    for year in range(3, time_period + 1):
+        columns[year] = matrix_years[time_period - (year - 1) + 1]
+    return columns
+
+
+if NUMBA_AVAILABLE:
+    @numba.njit(parallel=True, nogil=True, cache=True)
+    def simulate_paths_kernel(factors, thresholds, equity, matrix_columns, start_code, start_value, start_rows, step,
+                              codes, factors_used, values):
+        """The per-path loop of dynamic_engine.simulate_path, run for every start row in parallel.
+
+        Fills the preallocated (paths, years) codes, factors_used and values arrays; the arithmetic is the
+        same as the NumPy version, so the results are identical.
+        """
+        num_paths, time_period = values.shape
+        num_allocations = equity.shape[0]
+        for path in numba.prange(num_paths):
+            code = start_code
+            value = start_value
+            codes[path, 0] = -1
+            factors_used[path, 0] = value
+            values[path, 0] = value
+
+            for year in range(2, time_period + 1):
+                if year > 2:
+                    # Move to the lowest allocation below the current one whose matrix value the portfolio now covers
+                    column = matrix_columns[year]
+                    current_equity = equity[code]
+                    for candidate in range(num_allocations):
+                        if thresholds[candidate, column] <= value and equity[candidate] < current_equity:
+                            code = candidate
+                            break
+
+                factor = factors[(year - 2) * step + start_rows[path], code]
+                value = value * factor
+                codes[path, year - 1] = code
+                factors_used[path, year - 1] = factor
+                values[path, year - 1] = value
@@ -0,0 +1,197 @@
+import numpy as np
+
+
+def iter_rolling_products(factors, num_years=41, step=12):
+    """Yields (year, products) one horizon at a time, products shaped (rows, allocations).
+
+    Rows that run past the end of the data are NaN, Year 1 is all ones. Only the running product of the
+    current horizon is kept, so memory stays at one (rows, allocations) block.
+    """
+    factors = np.asarray(factors, dtype=float)
+    num_rows = factors.shape[0]
+
+    running = None
+    for year in range(1, num_years + 1):
+        block = np.full(factors.shape, np.nan)
+        if year == 1:
+            block[:] = 1.0
+        elif year == 2:
+            # Year 2 is just the single row value
+            running = factors.copy()
+            block[:] = running
+        else:
+            # Each later year multiplies in the factor one stride (12 rows) further down.
+            # Multiplying in the same order as the original row loop keeps the results bit-identical.
+            offset = (year - 2) * step
+            if offset < num_rows:
+                running = running[:num_rows - offset] * factors[offset:]
+                block[:num_rows - offset] = running
+        yield year, block
+
+
+def rolling_products(factors, num_years=41, step=12):
+    """Returns the multi-year factor products for every start row, shaped (years, rows, allocations)."""
+    factors = np.asarray(factors, dtype=float)
+    products = np.empty((num_years,) + factors.shape)
+    for year, block in iter_rolling_products(factors, num_years, step):
+        products[year - 1] = block
+    return products
+
+
+def horizon_minimums(factors, num_years=41, step=12, quantiles=()):
+    """Reduces every horizon's products across start rows without keeping more than one horizon in memory.
+
+    factors is (rows, allocations), or (rows, ..., allocations) to reduce several factor sets at once.
+    Returns a dict of (years, ..., allocations) arrays: 'min' (NaN rows skipped, NaN if a horizon has no rows),
+    'argmin' (start row index of the minimum, -1 if none) and 'quantiles', a {q: array} dict for the
+    requested quantiles.
+    """
+    factors = np.asarray(factors, dtype=float)
+    shape = (num_years,) + factors.shape[1:]
+    minimums = np.full(shape, np.nan)
+    argmins = np.full(shape, -1, dtype=np.int64)
+    quantile_values = {q: np.full(shape, np.nan) for q in quantiles}
+
+    for year, block in iter_rolling_products(factors, num_years, step):
+        valid = ~np.isnan(block)
+        has_rows = valid.any(axis=0)
+        rows = np.where(valid, block, np.inf).argmin(axis=0)
+        block_minimums = np.take_along_axis(block, rows[np.newaxis], axis=0)[0]
+        minimums[year - 1][has_rows] = block_minimums[has_rows]
+        argmins[year - 1][has_rows] = rows[has_rows]
+        for q in quantiles:
+            quantile_values[q][year - 1][has_rows] = np.nanquantile(block[:, has_rows], q, axis=0)
+
+    return {'min': minimums, 'argmin': argmins, 'quantiles': quantile_values}
+
+
+def static_ending_values(factors, allocation_codes, num_rows, step=12):
+    """Ending values of a static glide path for every start row, shaped (rows, years).
+
+    Year N holds the product of the first N - 1 stride factors of allocation column allocation_codes[N - 1].
+    A path that hits a NaN factor or runs past the end of the data ends at 0, Year 1 is always 1.
+    Also returns the values divided by each year's smallest non-zero ending value.
+
+    With factors shaped (rows, ..., allocations) and allocation_codes shaped (years, ...), every factor set
+    follows its own glide path and the results are shaped (rows, years, ...).
+    """
+    factors = np.asarray(factors, dtype=float)
+    allocation_codes = np.asarray(allocation_codes, dtype=np.int64)
+    num_years = allocation_codes.shape[0]
+
+    ending_values = np.zeros((num_rows, num_years) + factors.shape[1:-1])
+    available_rows = min(num_rows, factors.shape[0])
+    for year, block in iter_rolling_products(factors, num_years, step):
+        # Keep only the column of this year's allocation
+        codes = np.broadcast_to(allocation_codes[year - 1], block.shape[1:-1])
+        chosen = np.take_along_axis(block, codes[np.newaxis, ..., np.newaxis], axis=-1)[..., 0]
+        ending_values[:available_rows, year - 1] = chosen[:available_rows]
+    ending_values[:, 0] = 1.0
+    ending_values[np.isnan(ending_values)] = 0.0
+
+    # Smallest non-zero value of every year, NaN when a year has none
+    min_non_zero = np.where(ending_values != 0, ending_values, np.inf).min(axis=0)
+    min_non_zero[np.isinf(min_non_zero)] = np.nan
+    return ending_values, ending_values / min_non_zero
+
+
+# Slack for comparing costs to rule bounds, grid costs like 0.8 - 0.7 are not exact in floating point
+RULE_TOLERANCE = 1e-9
+
+
+def no_decrease(year, previous):
+    """The cost never goes down: a cheaper pick keeps the previous year's allocation."""
+    if previous is None:
+        return -np.inf, np.inf
+    return previous, np.inf
+
+
+def max_step(step):
+    """The cost moves by at most `step` (an equity fraction) from one year to the next."""
+    def rule(year, previous):
+        if previous is None:
+            return -np.inf, np.inf
+        return previous - step, previous + step
+    return rule
+
+
+def band(floor=0.0, ceiling=1.0):
+    """The cost stays between floor and ceiling, scalars or per-year arrays starting at Year_2."""
+    def rule(year, previous):
+        low = np.asarray(floor)[year] if np.ndim(floor) else floor
+        high = np.asarray(ceiling)[year] if np.ndim(ceiling) else ceiling
+        return low, high
+    return rule
+
+
+def rule_bounds(rules, year, previous, shape):
+    """(low, high) cost bounds of path year `year` (0 is Year_2) given the previous year's realized costs.
+
+    A rule is a function (year, previous) -> (low, high), previous being None in the first year. The bounds
+    of the rules are intersected in order; where a rule contradicts the ones before it, it wins.
+    """
+    low = np.full(shape, -np.inf)
+    high = np.full(shape, np.inf)
+    for rule in rules:
+        rule_low, rule_high = (np.broadcast_to(bound, shape) for bound in rule(year, previous))
+        conflict = (np.maximum(low, rule_low) > np.minimum(high, rule_high))
+        low = np.where(conflict, rule_low, np.maximum(low, rule_low))
+        high = np.where(conflict, rule_high, np.minimum(high, rule_high))
+    return low, high
+
+
+def rule_violations(path_costs, rules):
+    """Years (Year_2 on) of a (years, ...) realized cost path that fall outside the bounds of its rules."""
+    path_costs = np.asarray(path_costs, dtype=float)
+    violations = np.zeros(path_costs.shape, dtype=bool)
+    for year in range(len(path_costs)):
+        low, high = rule_bounds(rules, year, path_costs[year - 1] if year else None, path_costs.shape[1:])
+        violations[year] = (path_costs[year] < low - RULE_TOLERANCE) | (path_costs[year] > high + RULE_TOLERANCE)
+    return violations
+
+
+def lowest_cost_path(matrix, costs, rules=(no_decrease,)):
+    """Picks every year's lowest-cost allocation from a (years, ..., allocations) matrix, as s4 does.
+
+    Each year takes the allocation with the smallest matrix value (the first one on ties, NaN skipped). The
+    rules then bound every year's cost from Year_2 on, measured from the allocation actually held the year
+    before: a pick inside the bounds is kept, otherwise the year moves to the allocation inside the bounds with
+    the cost nearest to the pick. Year 1 is always cost 0 and value 1.
+    Returns the allocation codes (-1 for Year 1), costs and values, each shaped (years, ...). Raises a
+    ValueError if no allocation on the grid can meet the rules.
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    costs = np.asarray(costs, dtype=float)
+    num_years = matrix.shape[0]
+    grid_costs = np.where(np.isnan(costs), np.inf, costs)
+
+    # Unconstrained pick of every year after the first
+    year_matrix = matrix[1:]
+    picked_codes = np.where(np.isnan(year_matrix), np.inf, year_matrix).argmin(axis=-1)
+    picked_costs = costs[picked_codes]
+
+    # Year by year, so every year's bounds start from the allocation the previous year really ended up in
+    path_codes = picked_codes.copy()
+    previous = None
+    for year in range(len(path_codes)):
+        low, high = rule_bounds(rules, year, previous, path_codes.shape[1:])
+        allowed = ((grid_costs >= low[..., np.newaxis] - RULE_TOLERANCE) &
+                   (grid_costs <= high[..., np.newaxis] + RULE_TOLERANCE))
+        distance = np.where(allowed, np.abs(grid_costs - picked_costs[year][..., np.newaxis]), np.inf)
+        keep = np.take_along_axis(allowed, picked_codes[year][..., np.newaxis], axis=-1)[..., 0]
+        path_codes[year] = np.where(keep, picked_codes[year], distance.argmin(axis=-1))
+        previous = costs[path_codes[year]]
+
+    path_costs = costs[path_codes]
+    violations = rule_violations(path_costs, rules)
+    if violations.any():
+        years = sorted({int(year) + 2 for year in np.nonzero(violations)[0]})
+        raise ValueError(f"No allocation on the grid meets the rules in years {years}.")
+
+    codes = np.full((num_years,) + path_codes.shape[1:], -1, dtype=np.int64)
+    codes[1:] = path_codes
+    all_costs = np.zeros(codes.shape)
+    all_costs[1:] = path_costs
+    values = np.ones(codes.shape)
+    values[1:] = np.take_along_axis(year_matrix, path_codes[..., np.newaxis], axis=-1)[..., 0]
+    return codes, all_costs, values
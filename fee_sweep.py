@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+import storage
+from allocation_grid import default_grid
+from factor_engine import horizon_minimums, lowest_cost_path, no_decrease, static_ending_values
+
+# Fee already taken out of the factors in the portfolio workbook
+BASE_FEE_BPS = 20
+
+def fee_adjusted_factors(factors, fee_bps, base_fee_bps=BASE_FEE_BPS):
+    """Stacks the factors for every fee level, shaped (rows, fees, allocations).
+
+    Fees are an annual drag on every factor, so the base fee is taken back out and each fee level applied:
+    factor * (1 - fee / 10000) / (1 - base_fee / 10000). The base fee level reproduces the factors exactly.
+    """
+    factors = np.asarray(factors, dtype=float)
+    scale = (1 - np.asarray(fee_bps, dtype=float) / 10000) / (1 - base_fee_bps / 10000)
+    return factors[:, np.newaxis, :] * scale[np.newaxis, :, np.newaxis]
+
+def run_fee_sweep(fee_bps=range(0, 101, 10), base_fee_bps=BASE_FEE_BPS, apply_rule=True, num_years=41):
+    """Runs s3, s4 and s6 for every fee level in one pass over a fee axis and saves them to one workbook."""
+    fee_bps = list(fee_bps)
+    grid = default_grid()
+
+    # Load the portfolio factors written by s1
+    file_path = 'all_portfolio_annual_factor_20_bps.xlsx'
+    allocation_df = storage.read_sheet(file_path, sheet_name='allocation_factors')
+    factors = fee_adjusted_factors(allocation_df[grid.names].to_numpy(dtype=float), fee_bps, base_fee_bps)
+    num_rows = len(allocation_df)  # Every starting row of the factor data, as in s6
+
+    # s3: minimum product of every fee, horizon and allocation, and its inverse matrix, shaped (years, fees, allocations)
+    minimums = horizon_minimums(factors, num_years=num_years)['min']
+    matrix = 1 / minimums
+
+    # s4: the lowest cost allocation path of every fee, shaped (years, fees)
+    codes, costs, lowest_values = lowest_cost_path(matrix, grid.fractions, rules=[no_decrease] if apply_rule else [])
+
+    # s6: static ending values of every starting row following each fee's glide path, shaped (rows, years, fees)
+    static_codes = codes.copy()
+    static_codes[0] = len(grid) - 1  # Year 1 is always 1 whatever the allocation
+    ending_values, normalized_values = static_ending_values(factors, static_codes, num_rows)
+
+    year_columns = [f'Year_{year}' for year in range(1, num_years + 1)]
+
+    def allocation_sheet(values):
+        # One block of allocation rows per fee level
+        sheet = pd.DataFrame(values.transpose(1, 2, 0).reshape(-1, num_years), columns=year_columns)
+        sheet.insert(0, 'Allocation', grid.names * len(fee_bps))
+        sheet.insert(0, 'Fee (bps)', np.repeat(fee_bps, len(grid)))
+        return sheet
+
+    def starting_row_sheet(values):
+        # One block of starting rows per fee level
+        sheet = pd.DataFrame(values.transpose(2, 0, 1).reshape(-1, num_years), columns=year_columns)
+        sheet.insert(0, 'Starting Row', np.tile(np.arange(1, num_rows + 1), len(fee_bps)))
+        sheet.insert(0, 'Fee (bps)', np.repeat(fee_bps, num_rows))
+        return sheet
+
+    cost_factors_df = pd.DataFrame(np.concatenate([costs.T, lowest_values.T]), columns=year_columns)
+    cost_factors_df.insert(0, 'Factor', ['Lowest Cost Allocation'] * len(fee_bps) + ['Lowest Cost Value'] * len(fee_bps))
+    cost_factors_df.insert(0, 'Fee (bps)', fee_bps * 2)
+    cost_factors_df = cost_factors_df.sort_values('Fee (bps)', kind='stable').reset_index(drop=True)
+
+    output_file_path = 'fee_sweep.xlsx'
+    storage.write_sheets(output_file_path, {
+        'Min Values': allocation_sheet(minimums),
+        'Matrix': allocation_sheet(matrix),
+        'cost_factors_with_rules' if apply_rule else 'cost_factors': cost_factors_df,
+        'ending_values': starting_row_sheet(ending_values),
+        'ending_values_adjusted': starting_row_sheet(normalized_values),
+    })
+
+    print(f"Fee sweep for {fee_bps[0]}-{fee_bps[-1]} bps ({len(fee_bps)} levels) saved in: {output_file_path}")
+
+# Uncomment the line below if you want the module to still be runnable as a standalone script
+if __name__ == "__main__":
+    run_fee_sweep()
@@ -1,19 +1,27 @@
 import pandas as pd
 
+import results_store
+
 # Specify the number of years you want to access
 num_years = 35  # Change this value as needed
 
-# Define the file path and the worksheet names
-file_path = f"/Users/paulruedi/Desktop/py_test2/data_periods/output_year_{num_years}.xlsx"
+# Define the results folder and the worksheet names
+data_folder = "/Users/paulruedi/Desktop/py_test2/data_periods"
 weighted_allocations_sheet = "Weighted Allocations"  # Corrected worksheet name
 transposed_ending_values_sheet = "Transposed Ending Values"
 
-# Read the specified worksheets into DataFrames
-weighted_allocations_df = pd.read_excel(file_path, sheet_name=weighted_allocations_sheet)
-transposed_ending_values_df = pd.read_excel(file_path, sheet_name=transposed_ending_values_sheet)
+if results_store.has_horizon(data_folder, num_years):
+    # Slice the horizon out of the memory-mapped tensors instead of parsing a workbook
+    weighted_allocations = results_store.horizon_slice(data_folder, num_years, weighted_allocations_sheet)
+    transposed_ending_values = results_store.horizon_slice(data_folder, num_years, transposed_ending_values_sheet)
+else:
+    # Read the specified worksheets into DataFrames
+    file_path = f"{data_folder}/output_year_{num_years}.xlsx"
+    weighted_allocations = pd.read_excel(file_path, sheet_name=weighted_allocations_sheet, index_col=0).to_numpy()
+    transposed_ending_values = pd.read_excel(file_path, sheet_name=transposed_ending_values_sheet, index_col=0).to_numpy()
 
-# Calculate the average row values for the transposed_ending_values_df
-average_row_values = transposed_ending_values_df.mean(axis=1)
+# Calculate the average row values for the transposed ending values
+average_row_values = pd.Series(transposed_ending_values.mean(axis=1))
 
 # Get the lowest average row value
 lowest_average_value = average_row_values.min()
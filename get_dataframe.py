@@ -1,13 +1,40 @@
 import pandas as pd
+import numpy as np
 import os
 
-def load_data_frame(year):
-    # Construct the file path including the 'data_periods' folder
+import results_store
+
+def as_workbook_frame(df, sheet_name):
+    """A stored sheet as pd.read_excel returns it from the output_year_N workbook.
+
+    The workbook has the index as its first, unnamed column (except in Detailed Data), plain int64 and object
+    columns (whole-number floats included) and the 'NA' allocation read back as NaN.
+    """
+    if sheet_name in results_store.TENSOR_NAMES:
+        df = df.reset_index()
+        df = df.rename(columns={df.columns[0]: 'Unnamed: 0'})
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object).replace('NA', np.nan)
+        elif pd.api.types.is_integer_dtype(df[column]):
+            df[column] = df[column].astype('int64')
+        elif pd.api.types.is_float_dtype(df[column]) and df[column].notna().all() and (df[column] % 1 == 0).all():
+            # Excel does not keep floats and ints apart, whole numbers come back as int64
+            df[column] = df[column].astype('int64')
+    return df
+
+def load_data_frame(year, sheet_name='Portfolio Values'):
+    # Read the year from the results store in the 'data_periods' folder, or its workbook if it was not stored;
+    # both give the same frame
+    data_folder = 'data_periods'
+    if results_store.has_horizon(data_folder, year):
+        return as_workbook_frame(results_store.load_sheet(data_folder, year, sheet_name), sheet_name)
+
     file_name = f'output_year_{year}.xlsx'
-    file_path = os.path.join('data_periods', file_name)  # Cross-platform compatibility
+    file_path = os.path.join(data_folder, file_name)  # Cross-platform compatibility
     
     try:
-        df = pd.read_excel(file_path)
+        df = pd.read_excel(file_path, sheet_name=sheet_name)
         return df
     except FileNotFoundError:
         print(f"File {file_path} not found.")
@@ -1,25 +1,18 @@
+import os
+import multiprocessing
 import pandas as pd
 import numpy as np
 from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
-import time
+import instrumentation
+import results_store
+import storage
+from allocation_grid import default_grid
+from dynamic_engine import (allocation_for_percentage, prepare_inputs,
+                            simulate_path, simulate_paths, simulate_horizons, allocation_labels,
+                            allocation_categorical, dynamic_backend, CODE_DTYPE)
 
-start_time = time.time()
-
-# Your existing code that processes the data goes here
-
-
-def extract_equity_percentage(allocation):
-    try:
-        if allocation == 'LBM 100F':
-            return 0.0
-        elif allocation and 'LBM' in allocation:
-            number = int(allocation.split(' ')[-1][:-1])
-            return number / 100.0
-        else:
-            return np.nan
-    except Exception as e:
-        return np.nan
 
 def get_allocation_for_year(allocation_df, year_column):
     return allocation_df.loc[allocation_df['Factor'] == 'Lowest Cost Allocation', year_column].values[0]
@@ -27,81 +20,19 @@ def get_allocation_for_year(allocation_df, year_column):
 def determine_initial_allocation(allocation_df, total_years):
     year_column = f'Year_{total_years}'
     allocation_percentage = get_allocation_for_year(allocation_df, year_column)
-    allocation_mapping = {
-        1: 'LBM 100E', 0.9: 'LBM 90E', 0.8: 'LBM 80E', 0.7: 'LBM 70E',
-        0.6: 'LBM 60E', 0.5: 'LBM 50E', 0.4: 'LBM 40E', 0.3: 'LBM 30E',
-        0.2: 'LBM 20E', 0.1: 'LBM 10E', 0: 'LBM 100F'
-    }
-    rounded_value = round(allocation_percentage, 1)
-    return allocation_mapping.get(rounded_value, 'Unknown Allocation')
+    return allocation_for_percentage(allocation_percentage)
 
 def fetch_start_value(allocation_df, year_column):
     return allocation_df.loc[1, year_column]
 
-def calculate_allocations_and_values(portfolio_df, matrix_df, allocation_df, time_period, start_index):
-    start_allocation = determine_initial_allocation(allocation_df, time_period)
-    if start_allocation == 'Unknown Allocation':
-        raise ValueError("The initial allocation could not be determined.")
-    
-    year_column = f'Year_{time_period}'
-    start_value = fetch_start_value(allocation_df, year_column)
-    years = [1]
-    allocations = ['NA']
-    values = [start_value]
-    factors_used = [start_value]
-    detailed_years_data = []
-
-    detailed_years_data.append({
-        'Year': 1,
-        'Allocation': 'NA',
-        'Factor Used': 1,
-        'Ending Value': start_value
-    })
-
-    row_to_use_year_2 = start_index
-    factor_for_year_2 = portfolio_df[start_allocation].iloc[row_to_use_year_2]
-    current_value = values[-1] * factor_for_year_2
-    years.append(2)
-    allocations.append(start_allocation)
-    factors_used.append(factor_for_year_2)
-    values.append(current_value)
-
-    detailed_years_data.append({
-        'Year': 2,
-        'Allocation': start_allocation,
-        'Factor Used': factor_for_year_2,
-        'Ending Value': current_value
-    })
+def calculate_allocations_and_values(portfolio_df, matrix_df, allocation_df, time_period, start_index, inputs=None):
+    # The parsed arrays can be shared across calls; build them here only for one-off use
+    if inputs is None:
+        inputs = prepare_inputs(portfolio_df, matrix_df, allocation_df)
 
-    for year in range(3, time_period + 1):
-        matrix_year = time_period - (year - 1) + 1
-        matrix_column = f'Year_{matrix_year}'
-        filter_value = values[-1]
-
-        filtered_allocation = matrix_df[
-            (matrix_df[matrix_column] <= filter_value) &
-            (matrix_df['Allocation'].apply(extract_equity_percentage) < extract_equity_percentage(start_allocation))
-        ].copy()
-
-        if not filtered_allocation.empty:
-            filtered_allocation['Equity_Percentage'] = filtered_allocation['Allocation'].apply(extract_equity_percentage)
-            filtered_allocation = filtered_allocation.sort_values(by='Equity_Percentage')
-            start_allocation = filtered_allocation.iloc[0]['Allocation']
-
-        row_to_use = (year - 2) * 12 + start_index
-        factor_for_current_year = portfolio_df[start_allocation].iloc[row_to_use]
-        years.append(year)
-        allocations.append(start_allocation)
-        factors_used.append(factor_for_current_year)
-        current_value = values[-1] * factor_for_current_year
-        values.append(current_value)
-
-        detailed_years_data.append({
-            'Year': year,
-            'Allocation': start_allocation,
-            'Factor Used': factor_for_current_year,
-            'Ending Value': current_value
-        })
+    codes, factors_used, values = simulate_path(inputs, time_period, start_index)
+    years = np.arange(1, time_period + 1)
+    allocations = allocation_labels(inputs, codes)
 
     df_results = pd.DataFrame({
         'Year': years,
@@ -110,50 +41,79 @@ def calculate_allocations_and_values(portfolio_df, matrix_df, allocation_df, tim
         'Ending Value': values
     })
 
-    return df_results, pd.DataFrame(detailed_years_data)
-
-def process_all_rows_for_start_year(portfolio_df, matrix_df, allocation_df, time_period, start_row, end_row):
-    all_values = []
-    all_allocations = []
-    detailed_data_list = []
-    for i in range(start_row, end_row + 1):
-        results, detailed_data = calculate_allocations_and_values(portfolio_df, matrix_df, allocation_df, time_period, i)
-        all_values.append(results['Ending Value'].values)
-        all_allocations.append(results['Allocation'].values)
-        detailed_data['Run'] = i
-        detailed_data_list.append(detailed_data)
-
-    df_values = pd.DataFrame(all_values, columns=[f'Year_{i}' for i in range(1, time_period + 1)])
-    df_allocations = pd.DataFrame(all_allocations, columns=[f'Year_{i}' for i in range(1, time_period + 1)])
-    
-    if detailed_data_list:
-        detailed_data_df = pd.concat(detailed_data_list, ignore_index=True)
+    # The detailed data shows a factor of 1 for year 1 instead of the start value
+    detailed_factors = factors_used.copy()
+    detailed_factors[0] = 1
+    detailed_years_data = pd.DataFrame({
+        'Year': years,
+        'Allocation': allocations,
+        'Factor Used': detailed_factors,
+        'Ending Value': values
+    })
+
+    return df_results, detailed_years_data
+
+def build_detailed_data(inputs, codes, factors_used, values, runs, mask=None):
+    """Flattens simulated (..., years) arrays into the long 'Detailed Data' layout, keeping entries where mask is True.
+
+    Allocations are categorical and years and runs small integers, so the frame holds no Python objects.
+    """
+    if mask is None:
+        mask = np.ones(values.shape, dtype=bool)
+    years = np.broadcast_to(np.arange(1, values.shape[-1] + 1, dtype=np.int16), values.shape)
+    runs = np.broadcast_to(np.asarray(runs, dtype=np.int32).reshape((-1,) + (1,) * (values.ndim - 1)), values.shape)
+
+    # The detailed data shows a factor of 1 for year 1 instead of the start value
+    detailed_factors = factors_used.copy()
+    detailed_factors[..., 0] = 1
+
+    return pd.DataFrame({
+        'Year': years[mask],
+        'Allocation': allocation_categorical(inputs, codes[mask]),
+        'Factor Used': detailed_factors[mask],
+        'Ending Value': values[mask],
+        'Run': runs[mask]
+    })
+
+def process_all_rows_for_start_year(portfolio_df, matrix_df, allocation_df, time_period, start_row, end_row, inputs=None):
+    if inputs is None:
+        inputs = prepare_inputs(portfolio_df, matrix_df, allocation_df)
+
+    # Simulate every start row in the range together
+    start_rows = list(range(start_row, end_row + 1))
+    codes, factors_used, values = simulate_paths(inputs, time_period, start_rows)
+
+    df_values = pd.DataFrame(values, columns=[f'Year_{i}' for i in range(1, time_period + 1)])
+    df_allocations = pd.DataFrame(allocation_labels(inputs, codes), columns=[f'Year_{i}' for i in range(1, time_period + 1)])
+
+    if start_rows:
+        detailed_data_df = build_detailed_data(inputs, codes, factors_used, values, start_rows)
     else:
         detailed_data_df = pd.DataFrame()
 
     return df_values, df_allocations, detailed_data_df
 
-def run_simulation_across_years(portfolio_df, matrix_df, allocation_df, start_row, end_row, max_years):
-    all_values_results = []
-    all_allocations_results = []
+def run_simulation_across_years(portfolio_df, matrix_df, allocation_df, start_row, end_row, max_years, inputs=None):
+    if inputs is None:
+        inputs = prepare_inputs(portfolio_df, matrix_df, allocation_df)
+
+    start_rows = list(range(start_row, end_row + 1))
+    num_time_periods = max(max_years - 1, 0)
+
+    # One row per (time period, start row), zero padded (code -1, 'NA') past each time period
+    all_values = np.zeros((num_time_periods, len(start_rows), max_years))
+    all_codes = np.full((num_time_periods, len(start_rows), max_years), -1, dtype=CODE_DTYPE)
     all_detailed_data = []
 
     for start_year in range(2, max_years + 1):
-        df_values, df_allocations, detailed_data_df = process_all_rows_for_start_year(
-            portfolio_df, matrix_df, allocation_df, start_year, start_row, end_row)
-
-        num_padding = max_years - len(df_values.columns)
-        for row_idx in range(df_values.shape[0]):
-            values_with_padding = df_values.iloc[row_idx].tolist() + [0] * num_padding
-            allocations_with_padding = df_allocations.iloc[row_idx].tolist() + ['NA'] * num_padding
-            all_values_results.append(values_with_padding[:max_years])
-            all_allocations_results.append(allocations_with_padding[:max_years])
-        
-        all_detailed_data.append(detailed_data_df)
+        codes, factors_used, values = simulate_paths(inputs, start_year, start_rows)
+        all_values[start_year - 2, :, :start_year] = values
+        all_codes[start_year - 2, :, :start_year] = codes
+        all_detailed_data.append(build_detailed_data(inputs, codes, factors_used, values, start_rows))
 
     column_names = [f'Year_{i}' for i in range(1, max_years + 1)]
-    all_values_df = pd.DataFrame(all_values_results, columns=column_names)
-    all_allocations_df = pd.DataFrame(all_allocations_results, columns=column_names)
+    all_values_df = pd.DataFrame(all_values.reshape(-1, max_years), columns=column_names)
+    all_allocations_df = pd.DataFrame(allocation_labels(inputs, all_codes.reshape(-1, max_years)), columns=column_names)
 
     if all_detailed_data:
         all_detailed_data_df = pd.concat(all_detailed_data, ignore_index=True)
@@ -162,54 +122,120 @@ def run_simulation_across_years(portfolio_df, matrix_df, allocation_df, start_ro
 
     return all_values_df, all_allocations_df, all_detailed_data_df
 
+def column_totals(values):
+    """Sums (..., rows, years) values over the rows, adding each column up in the same order as DataFrame.sum."""
+    return np.ascontiguousarray(np.swapaxes(values, -1, -2)).sum(axis=-1)
+
+def weighted_allocation(values, fractions):
+    """Value-weighted equity fraction of every year column, shaped (..., years) from (..., rows, years) arrays.
+
+    Zero values (the padding past a path's time period) are masked out; a column without any other value
+    gets 0, and so does year 1, which has no allocation.
+    """
+    mask = values != 0
+    weights = np.where(mask, values, 0.0)
+    total = column_totals(weights)
+    weighted = column_totals(np.where(mask, fractions * weights, 0.0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        averages = np.where(mask.any(axis=-2), weighted / total, 0.0)
+    averages[..., 0] = 0  # Year 1 allocation typically set to 0
+    return averages
+
+def last_non_zero(values):
+    """The last non-zero value of every row of (..., years) values, NaN for a row of zeros."""
+    mask = values != 0
+    last = values.shape[-1] - 1 - np.argmax(mask[..., ::-1], axis=-1)
+    found = np.take_along_axis(values, last[..., np.newaxis], axis=-1)[..., 0]
+    return np.where(mask.any(axis=-1), found, np.nan)
+
+def equity_fractions(allocations):
+    """Equity fractions of an array of allocation names, each distinct name looked up once (NaN off the grid)."""
+    grid = default_grid()
+    codes, names = pd.factorize(np.asarray(allocations, dtype=object).ravel())
+    fractions = np.array([grid.fraction(name) for name in names], dtype=float)
+    return fractions[codes].reshape(np.shape(allocations))
+
+def code_fractions(inputs, codes):
+    """Equity fractions of allocation codes, NaN for -1 ('NA')."""
+    fractions = np.append(inputs['equity'] / 100.0, np.nan)
+    return fractions[codes]
+
 def calculate_weighted_allocation(values_df, allocations_df):
-    weighted_allocations = []
-    for year in values_df.columns:
-        allocations = allocations_df[year]
-        values = values_df[year]
-        
-        # Filter non-zero values
-        non_zero_mask = values != 0
-        non_zero_values = values[non_zero_mask]
-        non_zero_allocations = allocations[non_zero_mask].apply(extract_equity_percentage)
-        
-        # Calculate weighted average if there are non-zero values
-        weighted_avg = np.average(non_zero_allocations, weights=non_zero_values) if len(non_zero_values) > 0 else 0
-        weighted_allocations.append(weighted_avg)
-
-    weighted_allocations[0] = 0  # Year 1 allocation typically set to 0
-    return pd.DataFrame([weighted_allocations], columns=values_df.columns)
-    print(weighted_allocations_df)
+    weighted_allocations = weighted_allocation(values_df.to_numpy(dtype=float),
+                                               equity_fractions(allocations_df[values_df.columns].to_numpy()))
+    weighted_allocations_df = pd.DataFrame([weighted_allocations], columns=values_df.columns)
+    return weighted_allocations_df.astype({values_df.columns[0]: int})
 
 def get_last_non_zero_values(values_df):
-    return values_df.apply(lambda row: row[row != 0].iloc[-1] if any(row != 0) else np.nan, axis=1)
+    return pd.Series(last_non_zero(values_df.to_numpy(dtype=float)), index=values_df.index)
+
+def summarize_start_rows(values, fractions, start_rows):
+    """Portfolio values, weighted allocations and last non-zero values of every start row at once.
+
+    `values` and `fractions` are (start rows, time periods, years) arrays, zero padded past each time period.
+    """
+    column_names = [f'Year_{i}' for i in range(1, values.shape[-1] + 1)]
+    run_names = [f'Run_{start_row}' for start_row in start_rows]
+
+    portfolio_values_df = pd.DataFrame(column_totals(values), columns=column_names)
+    weighted_allocations_df = pd.DataFrame(weighted_allocation(values, fractions), index=run_names,
+                                           columns=column_names).astype({'Year_1': int})
+    transposed_ending_values_df = pd.DataFrame(last_non_zero(values), index=run_names)
+
+    return portfolio_values_df, weighted_allocations_df, transposed_ending_values_df
+
+def summarize_start_row(all_values_df, all_allocations_df, start_row):
+    # Every time period is kept; dropping the last 12 rows could never run, pandas refused the misaligned
+    # allocation rows for any horizon with more than 12 time periods
+    values = all_values_df.to_numpy(dtype=float)
+    fractions = equity_fractions(all_allocations_df[all_values_df.columns].to_numpy())
+    portfolio_val, weighted_allocations_df, last_non_zero_values_df = summarize_start_rows(
+        values[np.newaxis], fractions[np.newaxis], [start_row])
+    portfolio_val.index = [f'Total_{start_row}']
+
+    return portfolio_val, weighted_allocations_df, last_non_zero_values_df
+
+def accumulate_results_for_rows(portfolio_df, matrix_df, allocation_df, max_years, start_rows, inputs=None, batched=True,
+                                paths=None):
+    # Parse the allocations and matrix into arrays once for every start row
+    if inputs is None:
+        inputs = prepare_inputs(portfolio_df, matrix_df, allocation_df)
 
-def accumulate_results_for_rows(portfolio_df, matrix_df, allocation_df, max_years, start_rows):
     all_portfolio_values = []
     all_weighted_allocations = []
     all_transposed_ending_values = []
     all_detailed_data = []
 
-    for start_row in start_rows:
-        all_values_df, all_allocations_df, detailed_data_df = run_simulation_across_years(
-            portfolio_df, matrix_df, allocation_df, start_row, start_row, max_years)
+    if batched:
+        # Advance every start row in lockstep, one time period at a time, unless the paths were simulated already
+        if paths is None:
+            paths = simulate_horizons(inputs, max_years, start_rows)
+        codes, factors_used, values = paths
 
-        # Drop the last 12 rows from the Year 1 output
-        if len(all_values_df) > 12:  # Check if there are enough rows to drop
-            all_values_df = all_values_df[:-12]  # Drop the last 12 rows
-
-        portfolio_val = pd.DataFrame(all_values_df.sum(), columns=[f'Total_{start_row}']).T
+        # Summarize every start row at once from the padded arrays, no names are looked up
+        portfolio_val, weighted_allocations_df, last_non_zero_values_df = summarize_start_rows(
+            values, code_fractions(inputs, codes), start_rows)
         all_portfolio_values.append(portfolio_val)
-
-        weighted_allocations_df = calculate_weighted_allocation(all_values_df, all_allocations_df)
-        weighted_allocations_df.index = [f'Run_{start_row}']
         all_weighted_allocations.append(weighted_allocations_df)
-
-        last_non_zero_values_df = pd.DataFrame(get_last_non_zero_values(all_values_df)).T
-        last_non_zero_values_df.index = [f'Run_{start_row}']
         all_transposed_ending_values.append(last_non_zero_values_df)
 
-        all_detailed_data.append(detailed_data_df)
+        # Only the years inside each time period belong in the detailed data
+        if max_years > 1:
+            in_period = np.arange(max_years)[np.newaxis, :] < np.arange(2, max_years + 1)[:, np.newaxis]
+            all_detailed_data.append(build_detailed_data(
+                inputs, codes, factors_used, values, start_rows, np.broadcast_to(in_period, values.shape)))
+        else:
+            all_detailed_data.append(pd.DataFrame())
+    else:
+        for start_row in start_rows:
+            all_values_df, all_allocations_df, detailed_data_df = run_simulation_across_years(
+                portfolio_df, matrix_df, allocation_df, start_row, start_row, max_years, inputs)
+            portfolio_val, weighted_allocations_df, last_non_zero_values_df = summarize_start_row(
+                all_values_df, all_allocations_df, start_row)
+            all_portfolio_values.append(portfolio_val)
+            all_weighted_allocations.append(weighted_allocations_df)
+            all_transposed_ending_values.append(last_non_zero_values_df)
+            all_detailed_data.append(detailed_data_df)
 
     portfolio_values_df = pd.concat(all_portfolio_values, ignore_index=True)
     weighted_allocations_df = pd.concat(all_weighted_allocations)
@@ -217,6 +243,7 @@ def accumulate_results_for_rows(portfolio_df, matrix_df, allocation_df, max_year
     detailed_data_df = pd.concat(all_detailed_data, ignore_index=True)
 
     return portfolio_values_df, weighted_allocations_df, transposed_ending_values_df, detailed_data_df
+
 def add_column_of_ones(df):
     df.insert(0, 'Year_1', 1)
     return df
@@ -225,42 +252,208 @@ def rename_columns_to_match(df, reference_df):
     df.columns = reference_df.columns
     return df
 
-# Load the data from Excel
-portfolio_df = pd.read_excel('all_portfolio_annual_factor_20_bps.xlsx', sheet_name='allocation_factors')
-matrix_df = pd.read_excel('dynamic_data.xlsx', sheet_name='matrix')
-allocation_df = pd.read_excel('min_values_across_years_and_matrix.xlsx', sheet_name='cost_factors_with_rules')
-
-# Parameters for the simulation
-max_years_range = range(1, 6)  # Loop from 1 to 30
-act_start_row = 1  # 1-based index for starting row
-output_directory = '/Users/paulruedi/Desktop/py_test2/data_periods/'
-
-# Loop through max_years values
-for max_years in max_years_range:
+def accumulate_results_for_range(inputs, max_years_range, start_rows, act_start_row=1, num_rows=1152):
+    """Yields (max_years, accumulate_results_for_rows output) for every horizon, simulating each path only once.
+
+    A path depends on its time period and start row but not on the horizon it is reported in, so every time
+    period is simulated once for all the start rows of `start_rows` any horizon in the range needs, and each
+    horizon is sliced out of that one tensor. Horizons without rows in `start_rows` are skipped.
+    """
+    max_years_range = sorted(max_years_range)
+    start_rows = np.asarray(start_rows, dtype=np.int64)
+
+    # Start rows are contiguous from act_start_row - 1 for every horizon, longer horizons just have fewer
+    horizon_rows = {}
+    for max_years in max_years_range:
+        end_row = act_start_row - 1 + len(get_start_rows(max_years, act_start_row, num_rows))
+        horizon_rows[max_years] = int(np.count_nonzero(start_rows < end_row))
+    largest = max_years_range[-1]
+    rows_per_period = {time_period: max(rows for max_years, rows in horizon_rows.items() if max_years >= time_period)
+                       for time_period in range(2, largest + 1)}
+    codes, factors_used, values = simulate_horizons(inputs, largest, start_rows, rows_per_period)
+
+    for max_years in max_years_range:
+        rows = horizon_rows[max_years]
+        if rows == 0:
+            continue
+        paths = tuple(array[:rows, :max_years - 1, :max_years] for array in (codes, factors_used, values))
+        yield max_years, accumulate_results_for_rows(None, None, None, max_years, start_rows[:rows].tolist(), inputs,
+                                                     paths=paths)
+
+def get_start_rows(max_years, act_start_row=1, num_rows=1152):
     if max_years == 1:
-        num_rows_to_process = 1152 - (max_years * 12) + 12  # Adjust for Year 1
+        num_rows_to_process = num_rows - (max_years * 12) + 12  # Adjust for Year 1
     else:
-        num_rows_to_process = 1152 - (max_years * 12) + 24  # For other years
+        num_rows_to_process = num_rows - (max_years * 12) + 24  # For other years
+
+    return list(range(act_start_row - 1, act_start_row - 1 + num_rows_to_process))
+
+# Inputs of a worker process, attached to the shared memory blocks once when the worker starts
+_worker_inputs = None
+_worker_blocks = []
+
+def _share_array(array):
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+def _attach_shared_inputs(shared_arrays, other_inputs):
+    global _worker_inputs
+    inputs = dict(other_inputs)
+    for key, (name, shape, dtype) in shared_arrays.items():
+        block = shared_memory.SharedMemory(name=name)
+        _worker_blocks.append(block)
+        inputs[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    _worker_inputs = inputs
+
+def _accumulate_chunk(max_years, start_rows):
+    return accumulate_results_for_rows(None, None, None, max_years, start_rows, _worker_inputs)
+
+def _accumulate_range_chunk(max_years_range, start_rows, act_start_row, num_rows):
+    return dict(accumulate_results_for_range(_worker_inputs, max_years_range, start_rows, act_start_row, num_rows))
+
+def _concat_parts(parts):
+    return (
+        pd.concat([part[0] for part in parts], ignore_index=True),
+        pd.concat([part[1] for part in parts]),
+        pd.concat([part[2] for part in parts]),
+        pd.concat([part[3] for part in parts], ignore_index=True),
+    )
+
+def accumulate_results_in_parallel(inputs, max_years_range, act_start_row=1, workers=None, chunk_size=256, shared_paths=True,
+                                  num_rows=1152):
+    """Yields accumulate_results_for_rows output for each max_years, computed across worker processes.
+
+    With shared_paths every chunk of start rows is one task that simulates its paths once for all the horizons
+    (see accumulate_results_for_range); otherwise every (max_years, chunk of start rows) pair is one task. The
+    factor and matrix arrays reach the workers through shared memory, and the chunks are stitched back together
+    in start row order, so each horizon's frames are the same as a serial run.
+    """
+    blocks = []
+    shared_arrays = {}
+    for key in ('factors', 'thresholds'):
+        block, spec = _share_array(inputs[key])
+        blocks.append(block)
+        shared_arrays[key] = spec
+    other_inputs = {key: value for key, value in inputs.items() if key not in shared_arrays}
 
-    start_rows = list(range(act_start_row - 1, act_start_row - 1 + num_rows_to_process))
-
-    portfolio_values_df, weighted_allocations_df, transposed_ending_values_df, detailed_data_df = accumulate_results_for_rows(
-        portfolio_df, matrix_df, allocation_df, max_years, start_rows)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_attach_shared_inputs, initargs=(shared_arrays, other_inputs)) as executor:
+            if shared_paths:
+                # The shortest horizon has the most start rows, the others use a prefix of them
+                start_rows = max((get_start_rows(max_years, act_start_row, num_rows) for max_years in max_years_range),
+                                 key=len)
+                futures = [executor.submit(_accumulate_range_chunk, list(max_years_range), start_rows[i:i + chunk_size],
+                                           act_start_row, num_rows)
+                           for i in range(0, len(start_rows), chunk_size)]
+                chunks = [future.result() for future in futures]
+                for max_years in max_years_range:
+                    yield _concat_parts([chunk.pop(max_years) for chunk in chunks if max_years in chunk])
+                return
+
+            # Queue every task up front so the workers never wait on the writer
+            futures = {}
+            for max_years in max_years_range:
+                start_rows = get_start_rows(max_years, act_start_row, num_rows)
+                futures[max_years] = [executor.submit(_accumulate_chunk, max_years, start_rows[i:i + chunk_size])
+                                      for i in range(0, len(start_rows), chunk_size)]
+
+            for max_years in max_years_range:
+                yield _concat_parts([future.result() for future in futures.pop(max_years)])
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+def write_output_file(output_directory, max_years, portfolio_values_df, weighted_allocations_df, transposed_ending_values_df, detailed_data_df,
+                      start_row=0, export_excel=None):
     if 'Year_1' in portfolio_values_df.columns:
         portfolio_values_df['Year_1'] += 1
 
     transposed_ending_values_df = add_column_of_ones(transposed_ending_values_df)
     transposed_ending_values_df = rename_columns_to_match(transposed_ending_values_df, portfolio_values_df)
 
-    output_filename = f'{output_directory}output_year_{max_years}.xlsx'
-    with pd.ExcelWriter(output_filename, engine='openpyxl') as writer:
-        portfolio_values_df.to_excel(writer, sheet_name='Portfolio Values', index=True)
-        weighted_allocations_df.to_excel(writer, sheet_name='Weighted Allocations', index=True)
-        transposed_ending_values_df.to_excel(writer, sheet_name='Transposed Ending Values', index=True)
-        detailed_data_df.to_excel(writer, sheet_name='Detailed Data', index=False)
-
-    print(f"DataFrames for max_years {max_years} saved to {output_filename}.")
-
-    end_time = time.time()
-elapsed_time = end_time - start_time
-print(f"Execution time: {elapsed_time:.2f} seconds")
+    # Every horizon goes into the results store; the output_year_N workbook is only an export
+    results_store.write_horizon(output_directory, max_years, {
+        'Portfolio Values': portfolio_values_df,
+        'Weighted Allocations': weighted_allocations_df,
+        'Transposed Ending Values': transposed_ending_values_df,
+        'Detailed Data': detailed_data_df,
+    }, start_row)
+    print(f"DataFrames for max_years {max_years} saved to {results_store.horizon_dir(output_directory, max_years)}.")
+
+    if export_excel is None:
+        export_excel = storage.EXPORT_EXCEL
+    if export_excel:
+        output_filename = os.path.join(output_directory, f'output_year_{max_years}.xlsx')
+        with instrumentation.record(f'excel output_year_{max_years}.xlsx', rows=len(detailed_data_df)), \
+                pd.ExcelWriter(output_filename, engine='openpyxl') as writer:
+            portfolio_values_df.to_excel(writer, sheet_name='Portfolio Values', index=True)
+            weighted_allocations_df.to_excel(writer, sheet_name='Weighted Allocations', index=True)
+            transposed_ending_values_df.to_excel(writer, sheet_name='Transposed Ending Values', index=True)
+            detailed_data_df.to_excel(writer, sheet_name='Detailed Data', index=False)
+
+        print(f"DataFrames for max_years {max_years} saved to {output_filename}.")
+
+def count_paths(max_years, act_start_row=1, num_rows=1152):
+    """Glide paths simulated for one horizon: time periods 2 to max_years for every start row."""
+    return len(get_start_rows(max_years, act_start_row, num_rows)) * max(max_years - 1, 0)
+
+def run_dynamic_ev(max_years_range=range(1, 6), output_directory='/Users/paulruedi/Desktop/py_test2/data_periods/', act_start_row=1,
+                   workers=1, chunk_size=256, export_excel=None, shared_paths=True, backend=None):
+    # Timed as a whole, the report counts the simulated paths as its rows
+    with instrumentation.record('dynamic_ev') as timing:
+        # Load the data from the cached workbooks
+        portfolio_df = storage.read_sheet('all_portfolio_annual_factor_20_bps.xlsx', sheet_name='allocation_factors')
+        matrix_df = storage.read_sheet('dynamic_data.xlsx', sheet_name='matrix')
+        allocation_df = storage.read_sheet('min_values_across_years_and_matrix.xlsx', sheet_name='cost_factors_with_rules')
+
+        inputs = prepare_inputs(portfolio_df, matrix_df, allocation_df)
+        num_rows = len(portfolio_df)
+        # The simulation kernel travels with the inputs, worker processes included ('numpy' or 'numba')
+        inputs['backend'] = dynamic_backend(backend)
+
+        os.makedirs(output_directory, exist_ok=True)
+        results_store.init_store(output_directory, num_rows, max(max_years_range))
+
+        # Fan the horizons out over worker processes (all cores when workers is None), or run them one after another
+        if workers is None:
+            workers = os.cpu_count()
+        if workers > 1:
+            results = accumulate_results_in_parallel(inputs, max_years_range, act_start_row, workers, chunk_size,
+                                                     shared_paths, num_rows)
+
+            # Workbooks are written by worker processes too; each file only depends on its own horizon's frames.
+            # Their timings come back with the results and join this process's report
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+                writes = [executor.submit(instrumentation.run_recorded, write_output_file, output_directory, max_years,
+                                          *frames, start_row=act_start_row - 1, export_excel=export_excel)
+                          for max_years, frames in zip(max_years_range, results)]
+                for write in writes:
+                    _, entries = write.result()
+                    instrumentation.add_records(entries)
+            instrumentation.add_rows(sum(count_paths(max_years, act_start_row, num_rows) for max_years in max_years_range))
+        elif shared_paths:
+            # Every path is simulated once, each horizon is summarized from the shared tensor as it is written
+            start_rows = max((get_start_rows(max_years, act_start_row, num_rows) for max_years in max_years_range), key=len)
+            for max_years, frames in accumulate_results_for_range(inputs, max_years_range, start_rows, act_start_row,
+                                                                  num_rows):
+                write_output_file(output_directory, max_years, *frames, start_row=act_start_row - 1, export_excel=export_excel)
+                instrumentation.add_rows(count_paths(max_years, act_start_row, num_rows))
+        else:
+            for max_years in max_years_range:
+                paths = count_paths(max_years, act_start_row, num_rows)
+                with instrumentation.record(f'simulate horizon={max_years}', rows=paths):
+                    frames = accumulate_results_for_rows(portfolio_df, matrix_df, allocation_df, max_years,
+                                                         get_start_rows(max_years, act_start_row, num_rows), inputs)
+                write_output_file(output_directory, max_years, *frames, start_row=act_start_row - 1, export_excel=export_excel)
+                instrumentation.add_rows(paths)
+
+    # Measured around the whole run, loading and writing included
+    print(f"Execution time: {timing['Wall (s)']:.2f} seconds ({timing['CPU (s)']:.2f} s CPU)")
+
+# Parameters for the simulation when run as a script: max_years from 1 to 5, starting at the first row
+if __name__ == "__main__":
+    run_dynamic_ev(max_years_range=range(1, 6), output_directory='/Users/paulruedi/Desktop/py_test2/data_periods/', act_start_row=1,
+                   workers=None)
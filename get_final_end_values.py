@@ -1,30 +1,34 @@
 import pandas as pd
 import os
 
+import results_store
+
 # Define the file path
 file_path = '/Users/paulruedi/Desktop/py_test2/data_periods'
 
-# Initialize the new DataFrame with Year 1 data
-df_combined = pd.read_excel(os.path.join(file_path, 'output_year_1.xlsx'))
+if __name__ == "__main__":
+    # Initialize the new DataFrame with Year 1 data
+    if results_store.has_horizon(file_path, 1):
+        df_combined = results_store.load_sheet(file_path, 1, 'Portfolio Values').reset_index()
+    else:
+        df_combined = pd.read_excel(os.path.join(file_path, 'output_year_1.xlsx'))
+
+    # Year 1 is already loaded, the other years only need the last column of their first sheet.
+    # They come from the results store, or are parsed in parallel and reused from the cache when the
+    # workbook has not changed.
+    last_columns = [df_combined.iloc[:, -1].copy()] + results_store.last_columns(file_path, range(2, 42), 'Portfolio Values')
 
-# Loop through years 2 to 41
-for year in range(1, 42):
-    # Load the current year's data
-    df_year = pd.read_excel(os.path.join(file_path, f'output_year_{year}.xlsx'))
-    
-    # Print the number of rows in the current year's DataFrame
-    print(f"Year {year} has {df_year.shape[0]} rows.")
+    for year, last_column in enumerate(last_columns, start=1):
+        # Print the number of rows in the current year's DataFrame
+        print(f"Year {year} has {len(last_column)} rows.")
 
-    # Get the last column of the current year's DataFrame
-    last_column = df_year.iloc[:, -1]  # Assuming the last column is what you want
-    
-    # Add the last column to the combined DataFrame
-    df_combined[f'Year_{year}'] = last_column.reset_index(drop=True)
+        # Add the last column to the combined DataFrame
+        df_combined[f'Year_{year}'] = last_column.reset_index(drop=True)
 
-# Check the combined DataFrame's shape
-print(f"Combined DataFrame shape: {df_combined.shape}")
+    # Check the combined DataFrame's shape
+    print(f"Combined DataFrame shape: {df_combined.shape}")
 
-# Now df_combined contains Year 1 and last columns from Years 2 to 41
-df_combined.to_excel(os.path.join(file_path, 'combined_years_output.xlsx'), index=False)
+    # Now df_combined contains Year 1 and last columns from Years 2 to 41
+    df_combined.to_excel(os.path.join(file_path, 'combined_years_output.xlsx'), index=False)
 
-print("DataFrame created and saved as 'combined_years_output.xlsx'")
\ No newline at end of file
+    print("DataFrame created and saved as 'combined_years_output.xlsx'")
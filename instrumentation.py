@@ -0,0 +1,202 @@
+import contextlib
+import cProfile
+import csv
+import json
+import os
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:  # Optional, without it the RSS is read from /proc (Linux) or left out
+    psutil = None
+
+# Stages to profile with cProfile: VALGRO_PROFILE=s3_mins_and_matrix,dynamic or VALGRO_PROFILE=all
+PROFILE_ENV = 'VALGRO_PROFILE'
+PROFILE_DIR = 'profiles'
+RSS_SAMPLE_INTERVAL = 0.01  # Seconds between RSS samples while a record is open
+
+# Every finished record of this process, in the order they finished
+_records = []
+_records_lock = threading.Lock()
+_local = threading.local()
+
+
+def _active():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def _current_rss_mb():
+    # The current RSS; getrusage only knows the peak of the whole process so far, not of one stage
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2 ** 20
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# Open records whose RSS high-water mark the sampler thread keeps up to date
+_watched = []
+_watched_lock = threading.Lock()
+_watching = threading.Event()
+_sampler = None
+
+
+def _sample_rss():
+    while True:
+        _watching.wait()
+        rss = _current_rss_mb()
+        with _watched_lock:
+            for entry in _watched:
+                entry['_peak_rss'] = max(entry['_peak_rss'], rss)
+            if not _watched:
+                _watching.clear()
+        time.sleep(RSS_SAMPLE_INTERVAL)
+
+
+def _watch_rss(entry):
+    global _sampler
+    rss = _current_rss_mb()
+    if rss is None:
+        return None
+    entry['_peak_rss'] = rss
+    with _watched_lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_rss, name='rss-sampler', daemon=True)
+            _sampler.start()
+        _watched.append(entry)
+        _watching.set()
+    return rss
+
+
+def _unwatch_rss(entry):
+    # One last sample, so even a block shorter than the sampling interval gets its end state
+    rss = _current_rss_mb()
+    with _watched_lock:
+        # By identity, two open records can hold equal values
+        del _watched[next(i for i, watched in enumerate(_watched) if watched is entry)]
+        return max(entry.pop('_peak_rss'), rss)
+
+
+def _children_cpu():
+    # CPU time of worker processes that have been waited for, e.g. after a process pool shuts down
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def _profiled_stages():
+    value = os.environ.get(PROFILE_ENV, '')
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def _should_profile(name):
+    stages = _profiled_stages()
+    # One profiler per thread; stages started inside a profiled one show up in its profile
+    return bool(stages) and ('all' in stages or name in stages) and not getattr(_local, 'profiling', False)
+
+
+def add_rows(rows):
+    """Adds to the rows processed by the innermost record of the calling thread."""
+    stack = _active()
+    if stack:
+        stack[-1]['Rows'] = (stack[-1]['Rows'] or 0) + int(rows)
+
+
+@contextlib.contextmanager
+def record(name, rows=None):
+    """Times the block as one entry of the run report.
+
+    Records wall and CPU time (this thread plus finished worker processes), the highest RSS sampled while
+    the block ran and how far that is above the RSS it started at, and the rows processed, given here or added
+    with add_rows() from inside the block. Stages running at the same time share one process, so their RSS
+    samples overlap.
+    """
+    entry = {'Stage': name, 'Rows': rows}
+    stack = _active()
+    stack.append(entry)
+    start_rss = _watch_rss(entry)
+
+    profiler = None
+    if _should_profile(name):
+        profiler = cProfile.Profile()
+        _local.profiling = True
+        profiler.enable()
+
+    start_wall = time.perf_counter()
+    start_cpu = time.thread_time() + _children_cpu()
+    try:
+        yield entry
+    finally:
+        wall = time.perf_counter() - start_wall
+        cpu = time.thread_time() + _children_cpu() - start_cpu
+        if profiler is not None:
+            profiler.disable()
+            _local.profiling = False
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            entry['Profile'] = os.path.join(PROFILE_DIR, f'{name}.prof')
+            profiler.dump_stats(entry['Profile'])
+        stack.pop()
+        peak_rss = _unwatch_rss(entry) if start_rss is not None else None
+
+        entry['Wall (s)'] = wall
+        entry['CPU (s)'] = cpu
+        entry['Peak RSS (MB)'] = peak_rss
+        entry['RSS Delta (MB)'] = peak_rss - start_rss if peak_rss is not None else None
+        entry['Rows/s'] = entry['Rows'] / wall if entry['Rows'] and wall > 0 else None
+        with _records_lock:
+            _records.append(entry)
+
+
+def records():
+    with _records_lock:
+        return list(_records)
+
+
+def reset():
+    with _records_lock:
+        _records.clear()
+
+
+def add_records(entries):
+    """Adds records made in another process, as returned by run_recorded()."""
+    with _records_lock:
+        _records.extend(entries)
+
+
+def run_recorded(func, *args, **kwargs):
+    """Calls func and returns (its result, the records it made); submit this to a worker process, whose
+    records would otherwise never reach the parent's report, and pass them to add_records() there."""
+    with _records_lock:
+        start = len(_records)
+    result = func(*args, **kwargs)
+    with _records_lock:
+        entries = _records[start:]
+        del _records[start:]
+    return result, entries
+
+
+def write_report(path):
+    """Writes every record so far to a .json or .csv run report."""
+    entries = records()
+    fields = ['Stage', 'Wall (s)', 'CPU (s)', 'Peak RSS (MB)', 'RSS Delta (MB)', 'Rows', 'Rows/s', 'Profile']
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for entry in entries:
+                writer.writerow({field: entry.get(field) for field in fields})
+    else:
+        with open(path, 'w') as f:
+            json.dump([{field: entry.get(field) for field in fields} for entry in entries], f, indent=2)
+    print(f"Run report saved to: {path}")
+
+
+def print_report():
+    for entry in records():
+        rows = f"  {entry['Rows']} rows, {entry['Rows/s']:.0f}/s" if entry['Rows/s'] else ''
+        memory = f"  rss +{entry['RSS Delta (MB)']:.1f} MB" if entry.get('RSS Delta (MB)') is not None else ''
+        print(f"{entry['Stage']:<40} wall {entry['Wall (s)']:8.2f} s  cpu {entry['CPU (s)']:8.2f} s{memory}{rows}")
@@ -3,6 +3,8 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
+from cagr import calculate_all_cagr_differences
+
 # Set page configuration
 st.set_page_config(page_title="CAGR Difference Analysis", layout="wide")
 
@@ -44,37 +46,9 @@ def load_data():
 
 new_data_df = load_data()
 
-def calculate_cagr_differences_new(data, period_years):
-    period_length_months = period_years * 12
-    cagr_differences = []
-
-    for start_index in range(len(data) - period_length_months + 1):
-        period_df = data.iloc[start_index:start_index + period_length_months]
-
-        large_growth_start = period_df['Cumulative Large Growth'].iloc[0]
-        large_growth_end = period_df['Cumulative Large Growth'].iloc[-1]
-        small_value_start = period_df['Cumulative Small Value'].iloc[0]
-        small_value_end = period_df['Cumulative Small Value'].iloc[-1]
-
-        large_growth_cagr = ((large_growth_end / large_growth_start) ** (1 / period_years)) - 1
-        small_value_cagr = ((small_value_end / small_value_start) ** (1 / period_years)) - 1
-
-        cagr_difference = large_growth_cagr - small_value_cagr
-
-        cagr_differences.append({
-            'Start Date': period_df['Date'].iloc[0],
-            'End Date': period_df['Date'].iloc[-1],
-            'CAGR Difference': cagr_difference
-        })
-
-    return pd.DataFrame(cagr_differences)
-
 # Calculate CAGR differences for different periods
 periods = [5, 10, 15, 20, 25, 30]
-cagr_dfs = {
-    period: calculate_cagr_differences_new(new_data_df, period)
-    for period in periods
-}
+cagr_dfs = calculate_all_cagr_differences(new_data_df, periods, 'Cumulative Large Growth', 'Cumulative Small Value')
 
 # Calculate moving averages
 for df in cagr_dfs.values():
@@ -0,0 +1,151 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+import storage
+from dynamic_engine import dynamic_backend, prepare_inputs, simulate_paths
+from get_dynamic_ev import code_fractions
+
+# Scenario settings: synthetic 41 year paths built from blocks of consecutive historical years
+NUM_PATHS = 20000
+NUM_YEARS = 41
+BLOCK_YEARS = 5
+CHUNK_SIZE = 2048  # Paths simulated together; bounds the memory of one task
+SEED = 2024
+PERCENTILES = [1, 5, 10, 25, 50, 75, 90, 95, 99]
+
+
+def valid_block_starts(factors, block_years, step=12):
+    """Rows that start a block of `block_years` consecutive annual factors without a missing value."""
+    num_starts = len(factors) - (block_years - 1) * step
+    if num_starts <= 0:
+        raise ValueError(f"Not enough factor rows for blocks of {block_years} years.")
+    complete = np.isfinite(factors).all(axis=1)
+    rows = np.arange(num_starts)[:, np.newaxis] + step * np.arange(block_years)[np.newaxis, :]
+    return np.flatnonzero(complete[rows].all(axis=1))
+
+
+def bootstrap_paths(factors, num_paths, num_years, block_years, rng, starts=None, step=12):
+    """Synthetic (paths, num_years - 1, allocations) annual factors, years 2 to num_years of every path.
+
+    Each path strings together blocks of `block_years` consecutive annual factors (12 monthly rows apart),
+    each block starting at a random month, so the returns keep their serial and cross-allocation correlation
+    within a block.
+    """
+    if starts is None:
+        starts = valid_block_starts(factors, block_years, step)
+    num_factor_years = num_years - 1
+    num_blocks = -(-num_factor_years // block_years)
+    block_starts = starts[rng.integers(0, len(starts), size=(num_paths, num_blocks))]
+    rows = block_starts[:, :, np.newaxis] + step * np.arange(block_years)
+    return factors[rows.reshape(num_paths, -1)[:, :num_factor_years]]
+
+
+def simulate_scenarios(inputs, paths, num_years, backend=None):
+    """Runs the glide path of every time period 2 to num_years over the synthetic paths.
+
+    Returns (paths, time periods) ending values and value-weighted equity allocations of each path.
+    """
+    num_paths = len(paths)
+    # Year-major rows, so year y of path p is row (y - 2) * num_paths + p
+    scenario_inputs = dict(inputs, factors=np.ascontiguousarray(paths.transpose(1, 0, 2)).reshape(-1, paths.shape[2]))
+    start_rows = np.arange(num_paths)
+
+    ending_values = np.empty((num_paths, num_years - 1))
+    weighted_allocations = np.empty((num_paths, num_years - 1))
+    for time_period in range(2, num_years + 1):
+        codes, _, values = simulate_paths(scenario_inputs, time_period, start_rows, backend, step=num_paths)
+        ending_values[:, time_period - 2] = values[:, -1]
+
+        # Allocation of every invested year, weighted by the value it is held at (year 1 has none)
+        fractions = code_fractions(inputs, codes[:, 1:])
+        weighted_allocations[:, time_period - 2] = (fractions * values[:, 1:]).sum(axis=1) / values[:, 1:].sum(axis=1)
+    return ending_values, weighted_allocations
+
+
+# Inputs of a worker process, set once when the worker starts
+_worker_state = None
+
+def _init_worker(state):
+    global _worker_state
+    _worker_state = state
+
+def _run_chunk(seed_sequence, num_paths):
+    """One chunk of paths drawn from its own RNG stream, so the results do not depend on the worker count."""
+    state = _worker_state
+    rng = np.random.default_rng(seed_sequence)
+    paths = bootstrap_paths(state['factors'], num_paths, state['num_years'], state['block_years'], rng, state['starts'])
+    return simulate_scenarios(state['inputs'], paths, state['num_years'], state['inputs']['backend'])
+
+
+def distribution_sheet(samples, percentiles=PERCENTILES):
+    """Mean, minimum, percentiles and maximum of every (paths, time periods) column, one row per time period."""
+    sheet = pd.DataFrame({'Time Period': np.arange(2, samples.shape[1] + 2)})
+    sheet['Mean'] = samples.mean(axis=0)
+    sheet['Min'] = samples.min(axis=0)
+    for percentile, values in zip(percentiles, np.percentile(samples, percentiles, axis=0)):
+        sheet[f'P{percentile}'] = values
+    sheet['Max'] = samples.max(axis=0)
+    return sheet
+
+
+def run_monte_carlo(num_paths=NUM_PATHS, num_years=NUM_YEARS, block_years=BLOCK_YEARS, seed=SEED,
+                    chunk_size=CHUNK_SIZE, workers=1, backend=None):
+    """Block-bootstraps synthetic paths, runs the dynamic glide path over them and saves the distributions.
+
+    Paths are drawn and simulated in chunks of `chunk_size`, each with its own RNG stream spawned from `seed`,
+    across `workers` processes (None uses every core). The same seed and chunk size give the same results for
+    any number of workers or either backend.
+    """
+    with instrumentation.record('monte_carlo', rows=num_paths * (num_years - 1)):
+        # Same inputs as the dynamic simulation
+        portfolio_df = storage.read_sheet('all_portfolio_annual_factor_20_bps.xlsx', sheet_name='allocation_factors')
+        matrix_df = storage.read_sheet('dynamic_data.xlsx', sheet_name='matrix')
+        allocation_df = storage.read_sheet('min_values_across_years_and_matrix.xlsx', sheet_name='cost_factors_with_rules')
+        inputs = prepare_inputs(portfolio_df, matrix_df, allocation_df)
+        inputs['backend'] = dynamic_backend(backend)
+
+        factors = inputs['factors']
+        state = {
+            'factors': factors,
+            'starts': valid_block_starts(factors, block_years),
+            'num_years': num_years,
+            'block_years': block_years,
+            'inputs': {key: value for key, value in inputs.items() if key != 'factors'},
+        }
+
+        chunk_sizes = [min(chunk_size, num_paths - start) for start in range(0, num_paths, chunk_size)]
+        seed_sequences = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+
+        if workers is None:
+            workers = os.cpu_count()
+        workers = min(workers, len(chunk_sizes))
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_worker, initargs=(state,)) as executor:
+                results = list(executor.map(_run_chunk, seed_sequences, chunk_sizes))
+        else:
+            _init_worker(state)
+            results = [_run_chunk(seed_sequence, size) for seed_sequence, size in zip(seed_sequences, chunk_sizes)]
+
+        ending_values = np.concatenate([result[0] for result in results])
+        weighted_allocations = np.concatenate([result[1] for result in results])
+
+        output_file_path = 'monte_carlo_scenarios.xlsx'
+        storage.write_sheets(output_file_path, {
+            'Ending Values': distribution_sheet(ending_values),
+            'Weighted Allocations': distribution_sheet(weighted_allocations),
+        })
+
+    print(f"Distributions of {num_paths} bootstrapped {num_years} year paths ({block_years} year blocks, seed {seed}) "
+          f"saved in: {output_file_path}")
+    return ending_values, weighted_allocations
+
+
+# Uncomment the line below if you want the module to still be runnable as a standalone script
+if __name__ == "__main__":
+    run_monte_carlo(workers=None)
@@ -0,0 +1,179 @@
+import hashlib
+import inspect
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import instrumentation
+import storage
+from allocation_grid import allocation_step
+
+# Digests of the last successful run of every stage
+STATE_FILE = os.path.join(storage.CACHE_DIR_NAME, 'pipeline_state.json')
+
+
+class Stage:
+    """One pipeline step: the function to call, what it reads, what it writes and its parameters.
+
+    Inputs and outputs are either (workbook, sheet) pairs for cached workbooks (sheet None means every
+    sheet) or plain file paths. `deps` lists extra source files the stage's results depend on; the modules
+    it imports from the project are found on their own.
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), params=None, deps=()):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.deps = list(deps)
+
+
+def _artifact_file(artifact):
+    return artifact[0] if isinstance(artifact, tuple) else artifact
+
+
+def _hash_file(hasher, file_path):
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(chunk)
+
+
+def _hash_artifact(hasher, artifact):
+    if isinstance(artifact, tuple):
+        workbook_path, sheet_name = artifact
+        names = storage.sheet_names(workbook_path)
+        for name in (names if sheet_name is None else [sheet_name]):
+            hasher.update(name.encode())
+            _hash_file(hasher, storage.sheet_path(workbook_path, name))
+    else:
+        hasher.update(artifact.encode())
+        _hash_file(hasher, artifact)
+
+
+def _module_file(module):
+    file_path = getattr(module, '__file__', None)
+    return os.path.abspath(file_path) if file_path and file_path.endswith('.py') else None
+
+
+def source_files(stage):
+    """The stage's own module, every project module it imports (directly or not) and its declared deps.
+
+    Project modules are the ones next to the stage's module; installed packages are left out.
+    """
+    root_module = inspect.getmodule(stage.func)
+    root_dir = os.path.dirname(_module_file(root_module))
+    files = set()
+    pending = [root_module]
+    while pending:
+        module = pending.pop()
+        file_path = _module_file(module)
+        if file_path is None or file_path in files or os.path.dirname(file_path) != root_dir:
+            continue
+        files.add(file_path)
+        # Imported modules, and the modules of imported functions and classes
+        for value in list(vars(module).values()):
+            imported = value if inspect.ismodule(value) else sys.modules.get(getattr(value, '__module__', None) or '')
+            if imported is not None:
+                pending.append(imported)
+    files.update(os.path.abspath(dep) for dep in stage.deps)
+    return sorted(files)
+
+
+def stage_digest(stage):
+    """Hashes a stage's code (with the project modules it uses), parameters and the contents of everything it reads."""
+    hasher = hashlib.sha256()
+    hasher.update(stage.name.encode())
+    hasher.update(json.dumps(stage.params, sort_keys=True, default=str).encode())
+    # Every stage reads the allocation grid set with VALGRO_ALLOCATION_STEP
+    hasher.update(f'allocation_step={allocation_step()}'.encode())
+    for file_path in source_files(stage):
+        hasher.update(os.path.basename(file_path).encode())
+        _hash_file(hasher, file_path)
+    for artifact in stage.inputs:
+        _hash_artifact(hasher, artifact)
+    return hasher.hexdigest()
+
+
+def outputs_exist(stage):
+    for artifact in stage.outputs:
+        if isinstance(artifact, tuple):
+            workbook_path, sheet_name = artifact
+            if not os.path.exists(storage.sheet_path(workbook_path, sheet_name)):
+                return False
+        elif not os.path.exists(artifact):
+            return False
+    return True
+
+
+def _load_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE) as f:
+        return json.load(f)
+
+
+def _save_state(state):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    with open(STATE_FILE, 'w') as f:
+        json.dump(state, f, indent=2)
+
+
+def stage_dependencies(stages):
+    """Maps each stage name to the stages that write something it reads."""
+    producers = {}
+    for stage in stages:
+        for artifact in stage.outputs:
+            producers.setdefault(_artifact_file(artifact), set()).add(stage.name)
+
+    dependencies = {}
+    for stage in stages:
+        upstream = set()
+        for artifact in stage.inputs:
+            upstream |= producers.get(_artifact_file(artifact), set())
+        upstream.discard(stage.name)
+        dependencies[stage.name] = upstream
+    return dependencies
+
+
+def _run_stage(stage):
+    with instrumentation.record(stage.name):
+        stage.func(**stage.params)
+
+
+def run_pipeline(stages, max_workers=4, force=False):
+    """Runs the stages in dependency order, skipping the ones whose inputs and parameters are unchanged."""
+    dependencies = stage_dependencies(stages)
+    pending = {stage.name: stage for stage in stages}
+    finished = set()
+    running = {}
+    state = _load_state()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # Start (or skip) every stage whose upstream stages are all done
+            ready = [name for name in pending if dependencies[name] <= finished]
+            for name in ready:
+                stage = pending.pop(name)
+                digest = stage_digest(stage)
+                if not force and state.get(name) == digest and outputs_exist(stage):
+                    print(f"Skipping {name}: inputs and parameters unchanged")
+                    finished.add(name)
+                    continue
+                print(f"Running {name}")
+                running[executor.submit(_run_stage, stage)] = (stage, digest)
+
+            if ready and not running:
+                # Only skips happened, look for newly unblocked stages
+                continue
+            if not running:
+                raise RuntimeError(f"Pipeline has a dependency cycle between: {sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, digest = running.pop(future)
+                future.result()
+                state[stage.name] = digest
+                _save_state(state)
+                finished.add(stage.name)
@@ -0,0 +1,149 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+from column_combiner import load_last_columns
+
+# The dynamic results of every horizon live in one store inside the output folder:
+#   results_store/horizon=N/<sheet>.parquet  the four output sheets of horizon N
+#   results_store/<tensor>.npy               one (horizon, start_row, year) array per numeric sheet, NaN padded
+STORE_DIR_NAME = 'results_store'
+META_NAME = 'meta.json'
+# Default tensor size, the real factor history; init_store takes the sizes of the run at hand
+MAX_HORIZON = 41
+MAX_ROWS = 1152
+
+SHEET_NAMES = ['Portfolio Values', 'Weighted Allocations', 'Transposed Ending Values', 'Detailed Data']
+TENSOR_NAMES = {
+    'Portfolio Values': 'portfolio_values',
+    'Weighted Allocations': 'weighted_allocations',
+    'Transposed Ending Values': 'ending_values',
+}
+
+
+def store_dir(output_directory):
+    return os.path.join(output_directory, STORE_DIR_NAME)
+
+
+def horizon_dir(output_directory, horizon):
+    return os.path.join(store_dir(output_directory), f'horizon={horizon}')
+
+
+def sheet_path(output_directory, horizon, sheet_name):
+    return os.path.join(horizon_dir(output_directory, horizon), f'{sheet_name}.parquet')
+
+
+def tensor_path(output_directory, sheet_name):
+    return os.path.join(store_dir(output_directory), f'{TENSOR_NAMES[sheet_name]}.npy')
+
+
+def init_store(output_directory, num_rows=MAX_ROWS, max_horizon=MAX_HORIZON):
+    """Creates the tensors, big enough for `num_rows` start rows and horizons up to `max_horizon`.
+
+    Call once before horizons are written, possibly in parallel. Tensors that are too small are grown, keeping
+    the horizons already stored in them.
+    """
+    os.makedirs(store_dir(output_directory), exist_ok=True)
+    for sheet_name in TENSOR_NAMES:
+        path = tensor_path(output_directory, sheet_name)
+        old = np.load(path, mmap_mode='r') if os.path.exists(path) else None
+        shape = (max_horizon, num_rows, max_horizon)
+        if old is not None:
+            if all(size >= needed for size, needed in zip(old.shape, shape)):
+                continue
+            shape = tuple(max(size, needed) for size, needed in zip(old.shape, shape))
+            old = np.array(old)  # Read into memory, the file is replaced below
+        tensor = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=shape)
+        tensor[...] = np.nan
+        if old is not None:
+            tensor[:old.shape[0], :old.shape[1], :old.shape[2]] = old
+        tensor.flush()
+        del tensor
+
+
+def write_horizon(output_directory, horizon, sheets, start_row=0):
+    """Stores one horizon's sheets (sheet name -> DataFrame, as written to Excel).
+
+    Each horizon only touches its own folder and its own slice of the tensors, so horizons can be written
+    from several processes at once.
+    """
+    with instrumentation.record(f'write horizon={horizon}', rows=sum(len(df) for df in sheets.values())):
+        _write_horizon(output_directory, horizon, sheets, start_row)
+
+
+def _write_horizon(output_directory, horizon, sheets, start_row):
+    folder = horizon_dir(output_directory, horizon)
+    os.makedirs(folder, exist_ok=True)
+    for sheet_name, df in sheets.items():
+        df.to_parquet(sheet_path(output_directory, horizon, sheet_name))
+
+    num_rows = 0
+    for sheet_name in TENSOR_NAMES:
+        values = sheets[sheet_name].to_numpy(dtype=float)
+        num_rows = values.shape[0]
+        tensor = np.load(tensor_path(output_directory, sheet_name), mmap_mode='r+')
+        if horizon > tensor.shape[0] or values.shape[0] > tensor.shape[1] or values.shape[1] > tensor.shape[2]:
+            raise ValueError(f"Horizon {horizon} with {values.shape[0]} rows does not fit the {tensor.shape} "
+                             f"results store; call init_store with the run's row count and horizon.")
+        tensor[horizon - 1] = np.nan
+        tensor[horizon - 1, :values.shape[0], :values.shape[1]] = values
+        tensor.flush()
+        del tensor
+
+    # Written last, so a horizon only counts as stored once everything else is in place
+    with open(os.path.join(folder, META_NAME), 'w') as f:
+        json.dump({'rows': num_rows, 'start_row': start_row}, f)
+
+
+def has_horizon(output_directory, horizon):
+    return os.path.exists(os.path.join(horizon_dir(output_directory, horizon), META_NAME))
+
+
+def horizons(output_directory):
+    """Horizons in the store, in order."""
+    folder = store_dir(output_directory)
+    if not os.path.isdir(folder):
+        return []
+    found = [int(name.split('=')[1]) for name in os.listdir(folder) if name.startswith('horizon=')]
+    return sorted(horizon for horizon in found if has_horizon(output_directory, horizon))
+
+
+def read_horizon_meta(output_directory, horizon):
+    with open(os.path.join(horizon_dir(output_directory, horizon), META_NAME)) as f:
+        return json.load(f)
+
+
+def load_sheet(output_directory, horizon, sheet_name='Portfolio Values', columns=None):
+    return pd.read_parquet(sheet_path(output_directory, horizon, sheet_name), columns=columns)
+
+
+def load_tensor(output_directory, sheet_name='Transposed Ending Values'):
+    """The whole (horizon, start_row, year) array, memory-mapped read-only."""
+    return np.load(tensor_path(output_directory, sheet_name), mmap_mode='r')
+
+
+def horizon_slice(output_directory, horizon, sheet_name='Transposed Ending Values'):
+    """(start_row, year) values of one horizon: a view into the memory-mapped tensor, nothing is parsed."""
+    num_rows = read_horizon_meta(output_directory, horizon)['rows']
+    return load_tensor(output_directory, sheet_name)[horizon - 1, :num_rows, :horizon]
+
+
+def last_columns(output_directory, horizon_list, sheet_name, file_pattern='output_year_{year}.xlsx', workers=None):
+    """Last column of a sheet for every horizon: read from the store, or from the Excel workbook if not stored."""
+    columns = {}
+    excel_horizons = []
+    for horizon in horizon_list:
+        if has_horizon(output_directory, horizon):
+            df = load_sheet(output_directory, horizon, sheet_name)
+            columns[horizon] = df.iloc[:, -1].reset_index(drop=True)
+        else:
+            excel_horizons.append(horizon)
+
+    file_names = [os.path.join(output_directory, file_pattern.format(year=horizon)) for horizon in excel_horizons]
+    for horizon, column in zip(excel_horizons, load_last_columns(file_names, sheet_name, workers)):
+        columns[horizon] = column
+
+    return [columns[horizon] for horizon in horizon_list]
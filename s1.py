@@ -1,43 +1,49 @@
 import pandas as pd
 
-def run_factors_all_allocations():
+import instrumentation
+import storage
+from allocation_grid import AllocationGrid, default_grid
+
+def run_factors_all_allocations(file_path='annual_factors_100E_100F_20_bps.xlsx'):
     ##########
     ####### To get all factors for all allocations for all years 1-41, run this module first #########
     ####### Then run get_mult_period_factors.py ########
     ####### Then run get_mins_and_matrix.py ########
 
     # Load the Excel file
-    file_path = 'annual_factors_100E_100F_20_bps.xlsx'
-    df = pd.read_excel(file_path)
-
-    # Create new columns for each allocation (90E, 80E, ..., 10E)
-    allocations = [90, 80, 70, 60, 50, 40, 30, 20, 10]
-    for allocation in allocations:
+    df = storage.read_sheet(file_path)
+    instrumentation.add_rows(len(df))
+
+    # Create new columns for each allocation between 100E and 100F on the grid (90E, 80E, ..., 10E by default).
+    # Every stage reads the same grid, set with VALGRO_ALLOCATION_STEP, so the later ones find these columns
+    grid = default_grid()
+    blended = {}
+    for allocation in grid.blended_equity:
         equity_weight = allocation / 100.0
         fixed_income_weight = 1 - equity_weight
-        column_name = f'LBM {allocation}E'
-        df[column_name] = equity_weight * df['LBM 100E'] + fixed_income_weight * df['LBM 100F']
+        column_name = AllocationGrid.name_for_equity(allocation)
+        blended[column_name] = equity_weight * df['LBM 100E'] + fixed_income_weight * df['LBM 100F']
+    df = pd.concat([df, pd.DataFrame(blended, index=df.index)], axis=1)
 
-    # Define the desired order of columns
-    ordered_columns = ['Start', 'End', 'LBM 100E'] + [f'LBM {allocation}E' for allocation in allocations] + ['LBM 100F']
+    # Define the desired order of columns, the same order as the grid
+    ordered_columns = ['Start', 'End'] + grid.names
 
     # Reorder the DataFrame columns
     df = df[ordered_columns]
 
-    # Save the updated DataFrame back to the Excel file
-    output_file_path = 'all_portfolio_annual_factor_20_bps.xlsx'
-    df.to_excel(output_file_path, index=False)
-
     # Create a second DataFrame without 'Start' and 'End', and with an index starting at 1
     df_no_start_end = df.drop(columns=['Start', 'End'])
     df_no_start_end.insert(0, 'Index', range(0, len(df_no_start_end) ))
 
-    # Write both DataFrames to separate tabs in the Excel file
-    with pd.ExcelWriter(output_file_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-        df.to_excel(writer, sheet_name='All Data', index=False)
-        df_no_start_end.to_excel(writer, sheet_name='allocation_factors', index=False)
+    # Save both DataFrames as separate tabs of the output workbook
+    output_file_path = 'all_portfolio_annual_factor_20_bps.xlsx'
+    storage.write_sheets(output_file_path, {
+        'Sheet1': df,
+        'All Data': df,
+        'allocation_factors': df_no_start_end,
+    })
 
-    print(f"Updated Excel file saved with two tabs: 'All Data' and 'Indexed Data' in: {output_file_path}")
+    print(f"Updated factors saved with two tabs: 'All Data' and 'Indexed Data' in: {output_file_path}")
 
 # Uncomment the line below if you want the module to still be runnable as a standalone script
 if __name__ == "__main__":
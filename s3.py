@@ -1,51 +1,103 @@
+import numpy as np
 import pandas as pd
 
-def run_mins_and_matrix():
-    # Load the Excel file
-    file_path = 'row_product_portfolio_annual_factors_years_1_to_41.xlsx'
-
-    # Load the worksheet named 'Year_1_to_41'
-    df = pd.read_excel(file_path, sheet_name='Year_1_to_41')
-
-    # Initialize a list to store each allocation's data
-    data = []
+import instrumentation
+import storage
+from factor_engine import horizon_minimums
 
-    # Extract the unique years from the column names
-    years = set(col.split('_yr')[1] for col in df.columns)
+def run_mins_and_matrix(fused=True):
+    portfolio_file_path = 'all_portfolio_annual_factor_20_bps.xlsx'
 
-    # Loop through the years by extracting relevant columns
-    for year in sorted(years, key=int):
-        # Filter columns corresponding to the current year
-        year_columns = [col for col in df.columns if col.endswith(f'_yr{year}')]
+    if fused:
+        # Stream the products one horizon at a time straight from the portfolio factors,
+        # so the wide workbook from s2 is not needed
+        factors_df = storage.read_sheet(portfolio_file_path)
+        allocation_columns = list(factors_df.columns[2:])
+        reduced = horizon_minimums(factors_df[allocation_columns].to_numpy(dtype=float), num_years=41)
+        minimums, argmins = reduced['min'], reduced['argmin']
+    else:
+        allocation_columns, minimums, argmins = min_values_from_products()
 
-        # Calculate the minimum value for each allocation
-        min_values = df[year_columns].min()
+    year_columns = [f'Year_{year}' for year in range(1, minimums.shape[0] + 1)]
 
-        # If it's the first year, initialize the data structure with allocation names
-        if year == '1':  # The first year
-            data = [[alloc.split('_yr')[0]] for alloc in year_columns]
+    def allocation_sheet(values):
+        sheet = pd.DataFrame(values.T, columns=year_columns)
+        sheet.insert(0, 'Allocation', allocation_columns)
+        return sheet
 
-        # Append the minimum values for the current year to each allocation's row
-        for i, value in enumerate(min_values):
-            data[i].append(value)
-
-    # Convert the list of lists to a DataFrame for minimum values
-    columns = ['Allocation'] + [f'Year_{year}' for year in sorted(years, key=int)]
-    min_values_df = pd.DataFrame(data, columns=columns)
+    min_values_df = allocation_sheet(minimums)
 
     # Calculate the inverse values (1/min_value) for the matrix
     matrix_df = min_values_df.copy()
     for col in matrix_df.columns[1:]:  # Skip the 'Allocation' column
         matrix_df[col] = 1 / matrix_df[col]
 
-    # Save the result to a new Excel file with two sheets
+    # Where each minimum comes from: the start row and the dates of its first and last annual factor
+    all_data_df = storage.read_sheet(portfolio_file_path, sheet_name='All Data')
+    instrumentation.add_rows(len(all_data_df))
+    start_dates, end_dates = minimum_dates(all_data_df, argmins)
+
+    # Save the result to a new workbook
     output_file_path = 'min_values_across_years_and_matrix.xlsx'
-    with pd.ExcelWriter(output_file_path, engine='xlsxwriter') as writer:
-        min_values_df.to_excel(writer, sheet_name='Min Values', index=False)
-        matrix_df.to_excel(writer, sheet_name='Matrix', index=False)
+    storage.write_sheets(output_file_path, {
+        'Min Values': min_values_df,
+        'Matrix': matrix_df,
+        'Min Start Row': allocation_sheet(argmins),
+        'Min Start Date': allocation_sheet(start_dates),
+        'Min End Date': allocation_sheet(end_dates),
+    })
+
+    print(f"Minimum values, inverse matrix and minimum locations saved in: {output_file_path}")
+
+def date_array(column):
+    """A date column as datetime64 in its own resolution; forcing nanoseconds wraps dates past 2262."""
+    values = column.to_numpy()
+    if not np.issubdtype(values.dtype, np.datetime64):
+        values = pd.to_datetime(column).to_numpy()
+    return values
+
+def minimum_dates(all_data_df, argmins, step=12):
+    """Start and End dates from All Data of the window behind every minimum, NaT where there is none.
+
+    A Year_N window covers rows start, start + 12, ..., start + 12 * (N - 2), so Year_1 has no dates.
+    """
+    start_column = date_array(all_data_df['Start'])
+    end_column = date_array(all_data_df['End'])
+    start_dates = np.full(argmins.shape, np.datetime64('NaT'), dtype=start_column.dtype)
+    end_dates = np.full(argmins.shape, np.datetime64('NaT'), dtype=end_column.dtype)
+
+    last_rows = argmins + step * (np.arange(argmins.shape[0]) - 1)[:, np.newaxis]
+    found = (argmins >= 0) & (last_rows >= argmins) & (last_rows < len(all_data_df))
+    start_dates[found] = start_column[argmins[found]]
+    end_dates[found] = end_column[last_rows[found]]
+    return start_dates, end_dates
+
+def min_values_from_products():
+    """Minimum and start row of every allocation and year, read from the s2 products workbook."""
+    # Load the Excel file
+    file_path = 'row_product_portfolio_annual_factors_years_1_to_41.xlsx'
+
+    # Load the worksheet named 'Year_1_to_41'
+    df = storage.read_sheet(file_path, sheet_name='Year_1_to_41')
+
+    # Extract the unique years and the allocations from the column names
+    years = sorted(set(col.split('_yr')[1] for col in df.columns), key=int)
+    allocation_columns = [col.split('_yr')[0] for col in df.columns if col.endswith('_yr1')]
+
+    minimums = np.full((len(years), len(allocation_columns)), np.nan)
+    argmins = np.full(minimums.shape, -1, dtype=np.int64)
+
+    # Loop through the years by extracting relevant columns
+    for i, year in enumerate(years):
+        # Minimum and its row for each allocation, skipping rows past the end of the data
+        block = df[[f'{alloc}_yr{year}' for alloc in allocation_columns]].to_numpy(dtype=float)
+        has_rows = ~np.isnan(block).all(axis=0)
+        rows = np.where(np.isnan(block), np.inf, block).argmin(axis=0)
+        minimums[i, has_rows] = block[rows, np.arange(block.shape[1])][has_rows]
+        argmins[i, has_rows] = rows[has_rows]
 
-    print(f"Minimum values and inverse matrix saved in: {output_file_path}")
+    return allocation_columns, minimums, argmins
 
 # Uncomment the line below if you want the module to still be runnable as a standalone script
 if __name__ == "__main__":
-    run_mins_and_matrix()
\ No newline at end of file
+    run_mins_and_matrix()
@@ -1,20 +1,21 @@
 import pandas as pd
 
+import storage
+from allocation_grid import default_grid
+
 # Load your data
-portfolio_df = pd.read_excel('all_portfolio_annual_factor_20_bps.xlsx', sheet_name='allocation_factors')
-cost_df = pd.read_excel('min_values_across_years_and_matrix.xlsx', sheet_name='cost_factors_with_rules')
+portfolio_df = storage.read_sheet('all_portfolio_annual_factor_20_bps.xlsx', sheet_name='allocation_factors')
+cost_df = storage.read_sheet('min_values_across_years_and_matrix.xlsx', sheet_name='cost_factors_with_rules')
 
-# Function to extract equity percentage
-def extract_equity_percentage(allocation):
-    return int(allocation.split(' ')[-1][:-1]) / 100.0 if 'E' in allocation else 0.0
+grid = default_grid()
 
 # Step 1: Get cost and allocation for Year_3
 year_3_cost = cost_df.loc[1, 'Year_3']  # Fetching Year_3 cost
 initial_allocation = 0.10  # Initial allocation as per instructions
 
 # Step 2: Calculate the Year 1 and Year 2 product
-# Fetch the factor for initial allocation (LBM 10E) for Year 1 (row 0)
-allocation_column = 'LBM 10E'  # Since the allocation is 0.10, equivalent to 10% equity
+# Fetch the factor for the initial allocation (LBM 10E) for Year 1 (row 0)
+allocation_column = grid.names[grid.index_for_fraction(initial_allocation)]
 factor_year_1 = portfolio_df.loc[0, allocation_column]
 
 # Year 2 value is the product of cost and the factor from Year 1
@@ -2,26 +2,18 @@ import os
 import pandas as pd
 import numpy as np
 
-def combine_transposed_ending_values(data_folder, max_years=41):
+import results_store
+
+def combine_transposed_ending_values(data_folder, max_years=41, file_pattern='data_{year}_year_periods.xlsx', workers=None):
     """Combines the last columns from 'Transposed Ending Values' across multiple files."""
-    
-    # Initialize a list to store each year's last column data
-    all_columns = []
-
-    # Loop through years 1 to max_years (inclusive)
-    for year in range(1, max_years + 1):
-        # Construct the full file path for the current year
-        file_name = os.path.join(data_folder, f'data_{year}_year_periods.xlsx')
-        sheet_name = 'Transposed Ending Values'
-        
-        # Read the 'Transposed Ending Values' sheet from the file
-        df = pd.read_excel(file_name, sheet_name=sheet_name)
-        
-        # Extract the last column
-        last_column = df.iloc[:, -1].copy()  # Get the last column of the DataFrame
-        
-        # Add the column to the list with the proper column name
-        all_columns.append(last_column.rename(f'Year_{year}'))
+
+    # Years in the results store are read from it; for the rest only the last column of the workbook is
+    # parsed, in parallel, and only for files changed since the last run
+    last_columns = results_store.last_columns(data_folder, range(1, max_years + 1), 'Transposed Ending Values',
+                                              file_pattern, workers)
+
+    # Name each column after its year
+    all_columns = [column.rename(f'Year_{year}') for year, column in enumerate(last_columns, start=1)]
 
     # Concatenate all the columns into a single DataFrame
     final_df = pd.concat(all_columns, axis=1)
@@ -33,6 +25,6 @@ def combine_transposed_ending_values(data_folder, max_years=41):
     print(f"Data saved to {output_file}")
 
 # Uncomment the line below if you want the module to still be runnable as a standalone script
-# if __name__ == "__main__":
+if __name__ == "__main__":
     data_folder = '/Users/paulruedi/Desktop/py_test2/data_periods'
     combine_transposed_ending_values(data_folder)
\ No newline at end of file
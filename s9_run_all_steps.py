@@ -1,51 +1,108 @@
+import os
 
-import pandas as pd
+import s1
+import s2
+import s3
+import s4
+import s6
+import s8
+import get_dynamic_ev
+import instrumentation
+import results_store
+from pipeline import Stage, run_pipeline
 
+# Parameters for a full run
+FEE_BPS = 20
+APPLY_RULE = True
+FUSED_MINS = True  # s3 streams the products itself, so s2's wide workbook is skipped
+MAX_YEARS_RANGE = range(1, 6)
+DYNAMIC_WORKERS = None  # None uses every core
+DYNAMIC_BACKEND = None  # 'numpy' or 'numba'; None uses VALGRO_DYNAMIC_BACKEND
+OUTPUT_FOLDER = 'data_periods'
+RUN_REPORT = 'run_report'  # Written as run_report.json and run_report.csv
 
-import s1_get_factors_all_allocations
-import s2_get_mult_period_factors
-import s3_get_mins_and_matrix
-import s4_get_cost_matrix
-import s5_get_11_alloc_all_years_factors
-import s6_get_each_row_end_value
-import s7_get_all_years_ending_values
-import s8_get_final_ending_data_all_years
-import s9_run_all_steps  # Replace with actual module name that has the combine_transposed_ending_values function
+def build_stages(fee_bps=FEE_BPS, apply_rule=APPLY_RULE,
+                 max_years_range=MAX_YEARS_RANGE, output_folder=OUTPUT_FOLDER, fused_mins=FUSED_MINS):
+    """Declares every step with the workbook sheets it reads and writes."""
+    factors_file = f'annual_factors_100E_100F_{fee_bps}_bps.xlsx'
+    portfolio_file = 'all_portfolio_annual_factor_20_bps.xlsx'
+    products_file = 'row_product_portfolio_annual_factors_years_1_to_41.xlsx'
+    mins_file = 'min_values_across_years_and_matrix.xlsx'
+    static_file = 'ending_values_static_all_years.xlsx'
+    dynamic_file = 'dynamic_data.xlsx'
+    cost_sheet = 'cost_factors_with_rules' if apply_rule else 'cost_factors'
 
-def run_all_steps():
-    """Runs all steps from s1 to s8 and combines transposed ending values."""
-    
-    # Step 1: Run factors for all allocations
-    s1_get_factors_all_allocations.run_factors_all_allocations()
+    min_outputs = [(mins_file, sheet) for sheet in
+                   ['Min Values', 'Matrix', 'Min Start Row', 'Min Start Date', 'Min End Date']]
+    store_files = [results_store.sheet_path(output_folder, year, sheet)
+                   for year in max_years_range for sheet in results_store.SHEET_NAMES]
+    ending_value_files = [results_store.sheet_path(output_folder, year, 'Transposed Ending Values')
+                          for year in max_years_range]
 
-    # Step 2: Run multi-period factors
-    s2_get_mult_period_factors.run_mult_period_factors()
+    stages = [
+        # Step 1: Run factors for all allocations
+        Stage('s1_factors', s1.run_factors_all_allocations,
+              inputs=[(factors_file, None)],
+              outputs=[(portfolio_file, 'Sheet1'), (portfolio_file, 'All Data'), (portfolio_file, 'allocation_factors')],
+              params={'file_path': factors_file}),
+    ]
 
-    # Step 3: Run mins and matrix
-    s3_get_mins_and_matrix.run_mins_and_matrix()
+    if fused_mins:
+        # Step 3: Run mins and matrix, streaming the multi-period products (step 2) in memory
+        stages.append(
+            Stage('s3_mins_and_matrix', s3.run_mins_and_matrix,
+                  inputs=[(portfolio_file, 'Sheet1'), (portfolio_file, 'All Data')],
+                  outputs=min_outputs,
+                  params={'fused': True}))
+    else:
+        stages += [
+            # Step 2: Run multi-period factors
+            Stage('s2_mult_period_factors', s2.run_mult_period_factors,
+                  inputs=[(portfolio_file, 'Sheet1')],
+                  outputs=[(products_file, 'Year_1_to_41')]),
 
-    # Step 4: Run cost matrix
-    s4_get_cost_matrix.run_cost_matrix()
+            # Step 3: Run mins and matrix
+            Stage('s3_mins_and_matrix', s3.run_mins_and_matrix,
+                  inputs=[(products_file, 'Year_1_to_41'), (portfolio_file, 'All Data')],
+                  outputs=min_outputs,
+                  params={'fused': False}),
+        ]
 
-    # Step 5: Run allocation factors for all years
-    s5_get_11_alloc_all_years_factors.run_alloc_all_years_factors()
+    return stages + [
+        # Step 4: Run cost matrix (also writes the reverse matrix, so step 5 is not needed)
+        Stage('s4_cost_matrix', s4.run_cost_matrix,
+              inputs=[(mins_file, 'Matrix')],
+              outputs=[(mins_file, cost_sheet), (mins_file, 'reverse_matrix')],
+              params={'apply_rule': apply_rule}),
 
-    # Step 6: Run each row end value
-    s6_get_each_row_end_value.run_each_row_end_value()
+        # Step 6: Run each row end value
+        Stage('s6_each_row_end_value', s6.run_each_row_end_value,
+              inputs=[(portfolio_file, 'allocation_factors'), (mins_file, 'cost_factors_with_rules')],
+              outputs=[(static_file, 'ending_values'), (static_file, 'ending_values_adjusted')]),
 
-    # Step 7: Run all years ending values
-    portfolio_df = pd.read_excel('all_portfolio_annual_factor_20_bps.xlsx', sheet_name='allocation_factors')
-    matrix_df = pd.read_excel('dynamic_data.xlsx', sheet_name='matrix')
-    allocation_df = pd.read_excel('min_values_across_years_and_matrix.xlsx', sheet_name='cost_factors_with_rules')
-    output_folder = '/Users/paulruedi/Desktop/py_test2/data_periods'
-    
-    s7_get_all_years_ending_values.run_all_years_ending_values(portfolio_df, matrix_df, allocation_df, output_folder)
+        # Step 7: Run all years ending values with the dynamic glide path
+        Stage('s7_dynamic_ending_values', get_dynamic_ev.run_dynamic_ev,
+              inputs=[(portfolio_file, 'allocation_factors'), (dynamic_file, 'matrix'), (mins_file, 'cost_factors_with_rules')],
+              outputs=store_files,
+              params={'max_years_range': list(max_years_range), 'output_directory': output_folder,
+                      'workers': DYNAMIC_WORKERS, 'backend': DYNAMIC_BACKEND}),
 
-    # Step 8: Run final ending data for all years
-    s8_get_final_ending_data_all_years.run_final_ending_data_all_years()
+        # Step 8: Combine Transposed Ending Values
+        Stage('s8_combine_ending_values', s8.combine_transposed_ending_values,
+              inputs=ending_value_files,
+              outputs=[os.path.join(output_folder, 'combined_transposed_ending_values.xlsx')],
+              params={'data_folder': output_folder, 'max_years': max(max_years_range),
+                      'file_pattern': 'output_year_{year}.xlsx'}),
+    ]
 
-    # Combine Transposed Ending Values
-    your_module_name.combine_transposed_ending_values(output_folder)
+def run_all_steps(force=False):
+    """Runs all steps from s1 to s8, skipping the ones whose inputs have not changed, and reports their timings."""
+    instrumentation.reset()
+    run_pipeline(build_stages(), force=force)
+
+    instrumentation.print_report()
+    instrumentation.write_report(f'{RUN_REPORT}.json')
+    instrumentation.write_report(f'{RUN_REPORT}.csv')
 
 if __name__ == "__main__":
-    run_all_steps()
\ No newline at end of file
+    run_all_steps()
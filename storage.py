@@ -0,0 +1,147 @@
+import json
+import os
+
+import pandas as pd
+
+import instrumentation
+
+# Every workbook gets a binary twin under a 'cache' folder next to it: one Parquet file per sheet
+CACHE_DIR_NAME = 'cache'
+MANIFEST_NAME = 'sheets.json'
+
+# Excel is only written when asked for; set VALGRO_EXPORT_EXCEL=1 or call export_excel() at the end
+EXPORT_EXCEL = os.environ.get('VALGRO_EXPORT_EXCEL', '0') == '1'
+
+
+def workbook_cache_dir(workbook_path):
+    folder, file_name = os.path.split(workbook_path)
+    return os.path.join(folder, CACHE_DIR_NAME, os.path.splitext(file_name)[0])
+
+
+def sheet_path(workbook_path, sheet_name):
+    return os.path.join(workbook_cache_dir(workbook_path), f'{sheet_name}.parquet')
+
+
+def _manifest_path(workbook_path):
+    return os.path.join(workbook_cache_dir(workbook_path), MANIFEST_NAME)
+
+
+def _read_manifest(workbook_path):
+    manifest_path = _manifest_path(workbook_path)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def _write_manifest(workbook_path, manifest):
+    with open(_manifest_path(workbook_path), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def _cache_is_stale(workbook_path):
+    # The cache is rebuilt from Excel when there is none yet or the workbook was edited after it was written
+    manifest_path = _manifest_path(workbook_path)
+    if not os.path.exists(manifest_path):
+        return True
+    return os.path.exists(workbook_path) and os.path.getmtime(workbook_path) > os.path.getmtime(manifest_path)
+
+
+def _import_excel(workbook_path):
+    """Parses a workbook once and stores every sheet in the binary cache."""
+    sheets = pd.read_excel(workbook_path, sheet_name=None)
+    write_sheets(workbook_path, sheets, export_excel=False)
+
+    # Remember that Excel is the source of truth here so export_all() never overwrites it
+    manifest = _read_manifest(workbook_path)
+    manifest['imported'] = True
+    _write_manifest(workbook_path, manifest)
+
+
+def write_sheets(workbook_path, sheets, mode='w', index=False, export_excel=None):
+    """Stores each DataFrame in `sheets` (sheet name -> DataFrame) in the cache, and in Excel if enabled."""
+    with instrumentation.record(f'write {os.path.basename(workbook_path)}', rows=sum(len(df) for df in sheets.values())):
+        _write_sheets(workbook_path, sheets, mode, index, export_excel)
+
+
+def _write_sheets(workbook_path, sheets, mode, index, export_excel):
+    cache_dir = workbook_cache_dir(workbook_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Appending to a workbook that so far only exists as Excel keeps its existing sheets
+    if mode == 'a' and os.path.exists(workbook_path) and _cache_is_stale(workbook_path):
+        _import_excel(workbook_path)
+
+    manifest = _read_manifest(workbook_path) if mode == 'a' else None
+    if manifest is None:
+        # Start a fresh workbook, dropping any sheets left over from an earlier run
+        for file_name in os.listdir(cache_dir):
+            if file_name.endswith('.parquet'):
+                os.remove(os.path.join(cache_dir, file_name))
+        manifest = {'sheets': [], 'index': {}}
+
+    for sheet_name, df in sheets.items():
+        df.to_parquet(sheet_path(workbook_path, sheet_name), index=index or None)
+        if sheet_name not in manifest['sheets']:
+            manifest['sheets'].append(sheet_name)
+        manifest['index'][sheet_name] = index
+    manifest['imported'] = False
+
+    if export_excel is None:
+        export_excel = EXPORT_EXCEL
+    if export_excel:
+        _write_excel(workbook_path, manifest)
+
+    # The manifest is written last so it is never older than the workbook it mirrors
+    _write_manifest(workbook_path, manifest)
+
+
+def sheet_names(workbook_path):
+    if _cache_is_stale(workbook_path):
+        _import_excel(workbook_path)
+    return list(_read_manifest(workbook_path)['sheets'])
+
+
+def read_sheet(workbook_path, sheet_name=0):
+    """Loads one sheet from the cache, parsing the Excel workbook only if the cache is missing or stale."""
+    names = sheet_names(workbook_path)
+    if isinstance(sheet_name, int):
+        sheet_name = names[sheet_name]
+    if sheet_name not in names:
+        raise ValueError(f"Worksheet named '{sheet_name}' not found in {workbook_path}")
+    return pd.read_parquet(sheet_path(workbook_path, sheet_name), memory_map=True)
+
+
+def _write_excel(workbook_path, manifest):
+    with instrumentation.record(f'excel {os.path.basename(workbook_path)}'), pd.ExcelWriter(workbook_path) as writer:
+        for sheet_name in manifest['sheets']:
+            df = pd.read_parquet(sheet_path(workbook_path, sheet_name))
+            df.to_excel(writer, sheet_name=sheet_name, index=manifest['index'].get(sheet_name, False))
+            instrumentation.add_rows(len(df))
+
+
+def export_excel(workbook_path):
+    """Writes the cached sheets of one workbook out as an .xlsx file for reporting."""
+    manifest = _read_manifest(workbook_path)
+    if manifest is None:
+        raise FileNotFoundError(f"No cached sheets found for {workbook_path}")
+    _write_excel(workbook_path, manifest)
+    _write_manifest(workbook_path, manifest)
+    print(f"Excel workbook exported to: {workbook_path}")
+
+
+def export_all(folder='.'):
+    """Exports every workbook the pipeline wrote under `folder` to Excel, skipping imported inputs."""
+    cache_root = os.path.join(folder, CACHE_DIR_NAME)
+    if not os.path.isdir(cache_root):
+        return
+    for name in sorted(os.listdir(cache_root)):
+        workbook_path = os.path.join(folder, f'{name}.xlsx')
+        manifest = _read_manifest(workbook_path)
+        if manifest is not None and not manifest.get('imported', False):
+            export_excel(workbook_path)
+
+
+# Run the module directly to produce the Excel reports from the cache
+if __name__ == "__main__":
+    export_all()
@@ -1,7 +1,15 @@
+import io
+import os
+
 import streamlit as st
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+import altair as alt
 import matplotlib.dates as mdates
+from matplotlib.collections import LineCollection
+
+from cagr import calculate_cagr_differences
 
 # Set page configuration
 st.set_page_config(page_title="CAGR Difference Analysis", layout="wide")
@@ -33,75 +41,64 @@ ma_period = st.sidebar.slider(
     step=1
 )
 
-# Set display flags based on radio selection
-show_cagr_line = display_option in ["CAGR Difference Only", "Both Lines"]
-show_ma_line = display_option in ["Moving Average Only", "Both Lines"]
+# Display flags (show CAGR line, show MA line) for a radio selection
+def display_flags(display_option):
+    return (display_option in ["CAGR Difference Only", "Both Lines"],
+            display_option in ["Moving Average Only", "Both Lines"])
+
+# Source workbook and compared columns for each analysis type
+data_files = {
+    "Value vs Growth": 'val_gro.xlsx',
+    "Large Growth vs Small Value": 'lgsv.xlsx',
+}
+cagr_columns = {
+    "Value vs Growth": ('Cumulative Growth', 'Cumulative Value'),
+    "Large Growth vs Small Value": ('Cumulative Large Growth', 'Cumulative Small Value'),
+}
+
+def file_signature(file_path):
+    # Part of every cache key, so editing the workbook invalidates its cached results
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
 
 # Load the datasets
-@st.cache_data
-def load_data(analysis_type):
+@st.cache_data(max_entries=4)
+def load_data(analysis_type, signature):
+    file_path = data_files[analysis_type]
+    df = pd.read_excel(file_path)
+    df['Date'] = pd.to_datetime(df['Date'])
     if analysis_type == "Value vs Growth":
-        file_path = 'val_gro.xlsx'
-        df = pd.read_excel(file_path)
-        df['Date'] = pd.to_datetime(df['Date'])
         df['Cumulative Growth'] = (1 + df['Growth']).cumprod()
         df['Cumulative Value'] = (1 + df['Value']).cumprod()
     else:  # Large Growth vs Small Value
-        file_path = 'lgsv.xlsx'
-        df = pd.read_excel(file_path)
-        df['Date'] = pd.to_datetime(df['Date'])
         df['Cumulative Large Growth'] = (1 + df['Large Growth']).cumprod()
         df['Cumulative Small Value'] = (1 + df['Small Value']).cumprod()
     return df
 
-data_df = load_data(analysis_type)
-def calculate_cagr_differences(data, period_years, analysis_type):
-    period_length_months = period_years * 12
-    cagr_differences = []
-
-    for start_index in range(len(data) - period_length_months + 1):
-        period_df = data.iloc[start_index:start_index + period_length_months]
-
-        if analysis_type == "Value vs Growth":
-            start_1 = period_df['Cumulative Growth'].iloc[0]
-            end_1 = period_df['Cumulative Growth'].iloc[-1]
-            start_2 = period_df['Cumulative Value'].iloc[0]
-            end_2 = period_df['Cumulative Value'].iloc[-1]
-        else:  # Large Growth vs Small Value
-            start_1 = period_df['Cumulative Large Growth'].iloc[0]
-            end_1 = period_df['Cumulative Large Growth'].iloc[-1]
-            start_2 = period_df['Cumulative Small Value'].iloc[0]
-            end_2 = period_df['Cumulative Small Value'].iloc[-1]
-
-        cagr_1 = ((end_1 / start_1) ** (1 / period_years)) - 1
-        cagr_2 = ((end_2 / start_2) ** (1 / period_years)) - 1
-
-        cagr_difference = cagr_1 - cagr_2
-
-        cagr_differences.append({
-            'Start Date': period_df['Date'].iloc[0],
-            'End Date': period_df['Date'].iloc[-1],
-            'CAGR Difference': cagr_difference
-        })
+# The CAGR series only depend on the dataset and the period, so slider and display changes reuse them
+@st.cache_data(max_entries=32)
+def load_cagr_differences(analysis_type, period, signature):
+    data = load_data(analysis_type, signature)
+    return calculate_cagr_differences(data, period, *cagr_columns[analysis_type])
 
-    return pd.DataFrame(cagr_differences)
+signature = file_signature(data_files[analysis_type])
 
-# Calculate CAGR differences for different periods
+# Periods to chart; each one is its own cached chart, so only the selected periods are computed and drawn
 periods = [1, 3, 5, 10, 15, 20, 25, 30]
-cagr_dfs = {
-    period: calculate_cagr_differences(data_df, period, analysis_type)
-    for period in periods
-}
-
-# Calculate moving averages
-for df in cagr_dfs.values():
-    df['MA'] = df['CAGR Difference'].rolling(window=ma_period).mean()
+default_periods = [1, 10]  # A cheap first render; more periods can be added from the sidebar
+selected_periods = st.sidebar.multiselect(
+    "Periods (Years)",
+    periods,
+    default=default_periods
+)
 
-# Create the plots
-fig, axs = plt.subplots(8, 1, figsize=(14, 40))
-plt.subplots_adjust(hspace=0.8)
+# Matplotlib ships a PNG per chart, Altair sends the data and draws it in the browser
+chart_backend = st.sidebar.radio(
+    "Chart Backend",
+    ["Matplotlib", "Altair (Interactive)"]
+)
 
-def add_explanation_text(ax):
+def add_explanation_text(ax, analysis_type):
     if analysis_type == "Value vs Growth":
         ax.text(0.02, 0.95, 'If trending up: Growth outperforming Value', 
                 transform=ax.transAxes, fontsize=8, verticalalignment='top')
@@ -113,26 +110,23 @@ def add_explanation_text(ax):
         ax.text(0.02, 0.90, 'If Trending Down: Small Value outperforming Large Growth', 
                 transform=ax.transAxes, fontsize=8, verticalalignment='top')
 
-def plot_subplot(ax, data, period, color):
+def plot_subplot(ax, data, period, color, analysis_type, display_option, ma_period):
+    show_cagr_line, show_ma_line = display_flags(display_option)
     if show_cagr_line:
         ax.plot(data['End Date'], data['CAGR Difference'], label=f'{period}-Year Period', color=color)
     
     if show_ma_line:
         # Get the MA data
         ma_data = data['MA'].dropna()
-        dates = data['End Date'][ma_data.index]
-        
-        # Calculate the differences to determine rising/falling
-        diff = ma_data.diff()
+        dates = mdates.date2num(data['End Date'][ma_data.index])
+        values = ma_data.to_numpy()
         
-        # Create segments for rising and falling
-        for i in range(1, len(ma_data)):
-            if diff.iloc[i] >= 0:  # Rising or flat
-                ax.plot(dates.iloc[i-1:i+1], ma_data.iloc[i-1:i+1], 
-                       color='green', linewidth=1.5, linestyle='--')
-            else:  # Falling
-                ax.plot(dates.iloc[i-1:i+1], ma_data.iloc[i-1:i+1], 
-                       color='red', linewidth=1.5, linestyle='--')
+        # One segment per consecutive pair of points, green when rising or flat and red when falling
+        segments = np.stack([np.column_stack([dates[:-1], values[:-1]]),
+                             np.column_stack([dates[1:], values[1:]])], axis=1)
+        segment_colors = np.where(np.diff(values) >= 0, 'green', 'red')
+        ax.add_collection(LineCollection(segments, colors=segment_colors, linewidths=1.5, linestyles='--'))
+        ax.autoscale_view()
         
         # Add to legend (only once)
         ax.plot([], [], color='green', linestyle='--', label=f'{ma_period}-Period MA (Rising)')
@@ -160,26 +154,75 @@ def plot_subplot(ax, data, period, color):
     ax.axhline(0, color='red', linewidth=0.8, linestyle='--')
     ax.grid(True)
     ax.legend()
-    add_explanation_text(ax)
+    add_explanation_text(ax, analysis_type)
     
     # Rotate and align the tick labels so they look better
     plt.setp(ax.get_xticklabels(), rotation=45, ha='right')
 
-# Colors for different periods
-colors = ['blue', 'orange', 'green', 'red', 'purple', 'brown', 'pink', 'gray']
+def add_moving_average(data, ma_period):
+    data = data.copy()
+    data['MA'] = data['CAGR Difference'].rolling(window=ma_period).mean()
+    return data
+
+# Charts only depend on their arguments, display settings included, so every argument is part of the cache key
+@st.cache_data(max_entries=64)
+def render_matplotlib_chart(analysis_type, period, signature, display_option, ma_period, color):
+    data = add_moving_average(load_cagr_differences(analysis_type, period, signature), ma_period)
 
-# Plot each subplot
-for i, (period, color) in enumerate(zip(periods, colors)):
-    plot_subplot(axs[i], cagr_dfs[period], period, color)
+    fig, ax = plt.subplots(figsize=(14, 5))
+    plot_subplot(ax, data, period, color, analysis_type, display_option, ma_period)
+    ax.set_xlabel('End Date of Period')
 
-# Set x-label for the bottom subplot
-axs[-1].set_xlabel('End Date of Period')
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    plt.close(fig)
+    return buffer.getvalue()
 
-# Adjust layout
-plt.tight_layout(rect=[0, 0.03, 1, 0.95], h_pad=2.0)
+@st.cache_data(max_entries=64)
+def render_altair_chart(analysis_type, period, signature, display_option, ma_period, color):
+    data = add_moving_average(load_cagr_differences(analysis_type, period, signature), ma_period)
+    x_axis = alt.X('End Date:T', title='End Date of Period')
+    layers = [alt.Chart(pd.DataFrame({'Zero': [0]})).mark_rule(color='red', strokeDash=[4, 4]).encode(y='Zero:Q')]
+    show_cagr_line, show_ma_line = display_flags(display_option)
+
+    if show_cagr_line:
+        layers.append(alt.Chart(data).mark_line(color=color).encode(
+            x=x_axis, y=alt.Y('CAGR Difference:Q', axis=alt.Axis(format='%')),
+            tooltip=['Start Date:T', 'End Date:T', alt.Tooltip('CAGR Difference:Q', format='.2%')]))
+
+    if show_ma_line:
+        # Same rising/falling segments as the Matplotlib chart, one rule per consecutive pair of MA points
+        ma_data = data[['End Date', 'MA']].dropna()
+        values = ma_data['MA'].to_numpy()
+        segments = pd.DataFrame({
+            'End Date': ma_data['End Date'].to_numpy()[:-1],
+            'Next Date': ma_data['End Date'].to_numpy()[1:],
+            'MA': values[:-1],
+            'Next MA': values[1:],
+            'Trend': np.where(np.diff(values) >= 0, f'{ma_period}-Period MA (Rising)', f'{ma_period}-Period MA (Falling)')
+        })
+        trend_scale = alt.Scale(domain=[f'{ma_period}-Period MA (Rising)', f'{ma_period}-Period MA (Falling)'],
+                                range=['green', 'red'])
+        layers.append(alt.Chart(segments).mark_rule(strokeDash=[6, 3], strokeWidth=1.5).encode(
+            x=x_axis, x2='Next Date:T', y=alt.Y('MA:Q', axis=alt.Axis(format='%')), y2='Next MA:Q',
+            color=alt.Color('Trend:N', scale=trend_scale, title=None)))
 
-# Display the plot in Streamlit
-st.pyplot(fig)
+    title = f'CAGR Difference ({analysis_type}) for {period}-Year Periods'
+    return alt.layer(*layers).properties(title=title, height=350).to_dict()
+
+# Colors for different periods
+colors = ['blue', 'orange', 'green', 'red', 'purple', 'brown', 'pink', 'gray']
+
+# Draw each selected period as its own chart
+for period in selected_periods:
+    color = colors[periods.index(period)]
+    if chart_backend == "Matplotlib":
+        st.image(render_matplotlib_chart(analysis_type, period, signature, display_option, ma_period, color))
+    else:
+        st.vega_lite_chart(render_altair_chart(analysis_type, period, signature, display_option, ma_period, color),
+                           use_container_width=True)
+        data = load_cagr_differences(analysis_type, period, signature)
+        st.caption(f"Date Range: {data['Start Date'].iloc[0].strftime('%Y')} - {data['End Date'].iloc[-1].strftime('%Y')}")
 
 # Add explanatory text below the chart
 st.markdown("""
@@ -200,3 +243,4 @@ st.sidebar.markdown("""
 st.sidebar.write(f"Analysis Type: {analysis_type}")
 st.sidebar.write(f"Display Mode: {display_option}")
 st.sidebar.write(f"Moving Average Period: {ma_period}")
+st.sidebar.write(f"Chart Backend: {chart_backend}")
@@ -3,6 +3,8 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
+from cagr import calculate_all_cagr_differences
+
 # Set page configuration
 st.set_page_config(page_title="CAGR Difference Analysis", layout="wide")
 
@@ -44,37 +46,9 @@ def load_data():
 
 data_df = load_data()
 
-def calculate_cagr_differences(data, period_years):
-    period_length_months = period_years * 12
-    cagr_differences = []
-
-    for start_index in range(len(data) - period_length_months + 1):
-        period_df = data.iloc[start_index:start_index + period_length_months]
-
-        growth_start = period_df['Cumulative Growth'].iloc[0]
-        growth_end = period_df['Cumulative Growth'].iloc[-1]
-        value_start = period_df['Cumulative Value'].iloc[0]
-        value_end = period_df['Cumulative Value'].iloc[-1]
-
-        growth_cagr = ((growth_end / growth_start) ** (1 / period_years)) - 1
-        value_cagr = ((value_end / value_start) ** (1 / period_years)) - 1
-
-        cagr_difference = growth_cagr - value_cagr
-
-        cagr_differences.append({
-            'Start Date': period_df['Date'].iloc[0],
-            'End Date': period_df['Date'].iloc[-1],
-            'CAGR Difference': cagr_difference
-        })
-
-    return pd.DataFrame(cagr_differences)
-
 # Calculate CAGR differences for different periods
 periods = [5, 10, 15, 20, 25, 30]
-cagr_dfs = {
-    period: calculate_cagr_differences(data_df, period)
-    for period in periods
-}
+cagr_dfs = calculate_all_cagr_differences(data_df, periods, 'Cumulative Growth', 'Cumulative Value')
 
 # Calculate moving averages
 for df in cagr_dfs.values():